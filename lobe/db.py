@@ -10,12 +10,18 @@ from pydub.utils import mediainfo
 import pathlib
 from werkzeug import secure_filename
 from collections import defaultdict
+from types import SimpleNamespace
 from flask import flash
-from sqlalchemy import func
+from sqlalchemy import and_, case, func, literal, or_, union_all
+from sqlalchemy.exc import IntegrityError
 from flask_security import current_user
 from lobe.models import (Collection, Recording, Session, Token, Trim,
                          User, db, MosInstance, CustomRecording,
-                         CustomToken, MosRating, VerifierProgression)
+                         CustomToken, MosRating, VerifierProgression,
+                         PrioritySession, Verification, Role, VerifierIcon,
+                         VerifierTitle, VerifierQuote, ADMIN_ROLE_NAME,
+                         ActivityRollup)
+from lobe.tools.cache import TTLCache
 
 
 def create_tokens(collection_id, files, is_g2p):
@@ -312,6 +318,7 @@ def save_uploaded_collection(zip, zip_name, tsv_name, form):
 
                         recording._set_wave_params(recorder_settings)
 
+        record_session.update_numbers()
         db.session.commit()
 
         for t in tokens:
@@ -456,6 +463,9 @@ def save_uploaded_lobe_collection(zip, zip_name, json_name, form):
         for key in sessions:
             sessions[session_id]['session'].duration = sum(
                 sessions[session_id]['duration'])
+        db.session.flush()
+        for key in sessions:
+            sessions[key]['session'].update_numbers()
         db.session.commit()
 
         for t in tokens:
@@ -545,6 +555,9 @@ def save_recording_session(form, files):
         db.session.add(recording)
         db.session.flush()
         recording.add_file_obj(file_obj, recording_obj['settings'])
+    if record_session is not None:
+        db.session.flush()
+        record_session.update_numbers()
     db.session.commit()
 
     for token_id in recording_objs:
@@ -611,6 +624,8 @@ def sessions_day_info(sessions, user):
 def delete_recording_db(recording):
     collection = Collection.query.get(recording.get_collection_id())
     token = recording.get_token()
+    record_session = Session.query.get(recording.session_id) \
+        if recording.session_id is not None else None
     try:
         os.remove(recording.get_path())
         if recording.get_wav_path is not None:
@@ -622,6 +637,8 @@ def delete_recording_db(recording):
     db.session.commit()
 
     token.update_numbers()
+    if record_session is not None:
+        record_session.update_numbers()
     db.session.commit()
 
     collection.update_numbers()
@@ -708,18 +725,387 @@ def resolve_order(object, sort_by, order='desc'):
         return ordering.desc()
 
 
+def session_claim_columns(is_secondary=False, model=Session):
+    '''
+    Returns the (done, claimed_by, claimed_at) columns of Session, or
+    PrioritySession, for primary or secondary verification
+    '''
+    if is_secondary:
+        return (model.is_secondarily_verified,
+                model.secondarily_verified_by,
+                model.secondary_verification_claimed_at)
+    return (model.is_verified, model.verified_by,
+            model.verification_claimed_at)
+
+
+def claim_lease_cutoff():
+    '''
+    Returns the time before which a verification claim has expired
+    '''
+    return datetime.datetime.now() - datetime.timedelta(
+        seconds=app.config['VERIFICATION_LEASE_SECONDS'])
+
+
+def pending_sessions(user_id, is_secondary=False, model=Session,
+                     exclude_ids=()):
+    '''
+    Returns a query over the ids of the sessions of model that are left
+    to (secondarily) verify and user_id is allowed to verify
+    '''
+    done, _, _ = session_claim_columns(is_secondary, model)
+    pending = db.session.query(model.id).filter(done == False)
+    if model is PrioritySession:
+        # priority sessions are put together by admins from recordings
+        # of any collection, skip those with nothing left to verify
+        recording_done = Recording.is_secondarily_verified if is_secondary \
+            else Recording.is_verified
+        pending = pending.filter(
+            PrioritySession.is_dev == False,
+            PrioritySession.recordings.any(recording_done.isnot(True)))
+    else:
+        pending = pending\
+            .join(Collection, Session.collection_id == Collection.id)\
+            .filter(Collection.is_dev == False, Collection.verify == True)
+    if is_secondary:
+        # can't secondarily verify sessions you verified yourself
+        pending = pending.filter(
+            model.verified_by != None, model.verified_by != user_id)
+    if exclude_ids:
+        pending = pending.filter(model.id.notin_(exclude_ids))
+    return pending
+
+
+def session_priority_order(model=Session):
+    '''
+    Returns the order sessions of model are claimed in, i.e. sessions
+    marked with has_priority first and then the oldest first, which is
+    the order of the ix_Session_verify_ready indexes
+    '''
+    if model is Session:
+        return [Session.has_priority.desc(), Session.id]
+    return [model.id]
+
+
+# The order verifiers are given work in, (model, is_secondary)
+VERIFICATION_SCHEDULE = [
+    (PrioritySession, False),
+    (Session, False),
+    (PrioritySession, True),
+    (Session, True)]
+
+
+def resume_session_claim(user_id, exclude=None):
+    '''
+    Returns (session, is_secondary, is_priority) for the first
+    unfinished session user_id has claimed, in VERIFICATION_SCHEDULE
+    order and then oldest first, with its lease renewed, or None. The
+    claims of every schedule entry are found with one UNION ALL query.
+    Input arguments:
+    * user_id (int): The verifier
+    * exclude (dict=None): Ids of sessions to skip per model
+    '''
+    exclude = exclude or {}
+    claims = []
+    for tier, (model, is_secondary) in enumerate(VERIFICATION_SCHEDULE):
+        _, claimed_by, _ = session_claim_columns(is_secondary, model)
+        claims.append(
+            pending_sessions(
+                user_id, is_secondary, model, exclude.get(model, ()))
+            .filter(claimed_by == user_id)
+            .with_entities(literal(tier).label('tier'), model.id.label('id'))
+            .statement)
+    claims = union_all(*claims).alias('claims')
+    own_claim = db.session.query(claims.c.tier, claims.c.id)\
+        .order_by(claims.c.tier, claims.c.id).first()
+    if own_claim is None:
+        return None
+    model, is_secondary = VERIFICATION_SCHEDULE[own_claim.tier]
+    renew_session_claim(own_claim.id, user_id, is_secondary, model)
+    db.session.commit()
+    return (model.query.get(own_claim.id), is_secondary,
+            model is PrioritySession)
+
+
+def claim_session(user_id, is_secondary=False, max_attempts=10,
+                  exclude_ids=(), model=Session, resume=True):
+    '''
+    Claims a session of model for (secondary) verification by user_id
+    and returns it, or None if there are no sessions left. The session
+    is picked with a single SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent claimers never wait on or get the same row, ordered by
+    1. Unless resume is False, a session the user has already claimed
+    but not finished, whose lease is then renewed
+    2. Unclaimed sessions
+    3. Sessions whose claim has expired
+    and then session_priority_order, and claimed with a compare-and-set
+    UPDATE. Databases without SKIP LOCKED, e.g. SQLite, just skip the
+    locking and rely on the UPDATE, retrying up to max_attempts times
+    if another claimer got there first.
+    Claims expire VERIFICATION_LEASE_SECONDS after they were made or
+    last renewed. Sessions in exclude_ids are never returned, e.g. the
+    one the user is verifying when the next one is claimed in advance.
+    '''
+    _, claimed_by, claimed_at = session_claim_columns(is_secondary, model)
+    pending = pending_sessions(user_id, is_secondary, model, exclude_ids)
+    now = datetime.datetime.now()
+    claimable = [
+        claimed_by == None,
+        claimed_at == None,
+        claimed_at < claim_lease_cutoff()]
+    if resume:
+        claimable.append(claimed_by == user_id)
+    claimable = or_(*claimable)
+    claim_order = case(
+        [(claimed_by == user_id, 0), (claimed_by == None, 1)], else_=2)
+    for _ in range(max_attempts):
+        candidate = pending.filter(claimable)\
+            .order_by(claim_order, *session_priority_order(model))\
+            .with_for_update(skip_locked=True, of=model)\
+            .first()
+        if candidate is None:
+            return None
+        num_claimed = model.query\
+            .filter(model.id == candidate.id, claimable)\
+            .update({claimed_by: user_id, claimed_at: now},
+                    synchronize_session=False)
+        db.session.commit()
+        if num_claimed == 1:
+            return model.query.get(candidate.id)
+    return None
+
+
+def schedule_session(user_id, exclude=None):
+    '''
+    Picks the session user_id should verify next, claims it and returns
+    (session, is_secondary, is_priority), or (None, False, False) if
+    there is nothing left to verify. Sessions are picked in this order:
+    1. Sessions the user has claimed but not finished, so verifiers
+    finish their own work before taking new work from others
+    2. Priority sessions
+    3. Sessions marked with has_priority and then the oldest sessions
+    4. The same for secondary verification
+    Step 1 is one query, see resume_session_claim, and each schedule
+    entry after it one claim query, see claim_session. Priority
+    sessions and sessions are separate tables and FOR UPDATE can't be
+    used on a UNION, so they can't share the claim query.
+    Input arguments:
+    * user_id (int): The verifier
+    * exclude (dict=None): Ids of sessions to skip per model, e.g.
+    {Session: [1]}
+    '''
+    exclude = exclude or {}
+    own_claim = resume_session_claim(user_id, exclude)
+    if own_claim is not None:
+        return own_claim
+    for model, is_secondary in VERIFICATION_SCHEDULE:
+        chosen_session = claim_session(
+            user_id, is_secondary, exclude_ids=exclude.get(model, ()),
+            model=model, resume=False)
+        if chosen_session is not None:
+            return chosen_session, is_secondary, model is PrioritySession
+    return None, False, False
+
+
+def renew_session_claim(session_id, user_id, is_secondary=False,
+                        model=Session):
+    '''
+    Renews the lease of user_id on the session if user_id holds the
+    (secondary) verification claim. Does not commit.
+    '''
+    _, claimed_by, claimed_at = session_claim_columns(is_secondary, model)
+    model.query\
+        .filter(model.id == session_id, claimed_by == user_id)\
+        .update({claimed_at: datetime.datetime.now()},
+                synchronize_session=False)
+
+
+def expired_session_claims(is_secondary=False, model=Session):
+    '''
+    Returns a query over the unfinished sessions of model, Session or
+    PrioritySession, whose (secondary) verification claim has expired
+    '''
+    done, claimed_by, claimed_at = session_claim_columns(
+        is_secondary, model)
+    return model.query.filter(
+        done == False,
+        claimed_by != None,
+        or_(claimed_at == None, claimed_at < claim_lease_cutoff()))
+
+
+def verifiers_filter(include_admins=False):
+    '''
+    Returns the filter matching active verifiers and, if include_admins,
+    all admins
+    '''
+    is_verifier = and_(
+        User.active == True, User.roles.any(Role.name == 'Greinir'))
+    if include_admins:
+        return or_(is_verifier, User.roles.any(Role.name == ADMIN_ROLE_NAME))
+    return is_verifier
+
+
 def get_verifiers():
-    return [u for u in User.query.filter(User.active == True)
-            if any(r.name == 'Greinir' for r in u.roles)]
+    return User.query.filter(verifiers_filter()).all()
 
 
 def get_admins():
-    return [u for u in User.query.all()
-            if u.is_admin()]
+    return User.query.filter(
+        User.roles.any(Role.name == ADMIN_ROLE_NAME)).all()
 
 
 def get_verifiers_and_admins():
-    return list(set(get_admins() + get_verifiers()))
+    return User.query.filter(verifiers_filter(include_admins=True)).all()
+
+
+leaderboard_cache = TTLCache()
+
+
+def get_leaderboard(include_admins=False):
+    '''
+    Returns the verifiers, and admins if include_admins, ranked by
+    their weekly verifications. Each verifier has the id and name of
+    the user and a progression with the columns of VerifierProgression
+    and the equipped icon, title and quote, everything from one joined
+    query. The result is cached for LEADERBOARD_CACHE_SECONDS and
+    dropped on verification writes, see invalidate_leaderboard, so the
+    entries are plain objects rather than model instances.
+    '''
+    return leaderboard_cache.get_or_set(
+        include_admins,
+        lambda: query_leaderboard(include_admins),
+        app.config['LEADERBOARD_CACHE_SECONDS'])
+
+
+def query_leaderboard(include_admins=False):
+    rows = db.session.query(
+            User.id, User.name, VerifierProgression,
+            VerifierIcon.fa_id, VerifierIcon.color,
+            VerifierIcon.title.label('icon_title'),
+            VerifierTitle.title, VerifierQuote.quote)\
+        .join(VerifierProgression,
+              User.progression_id == VerifierProgression.id)\
+        .outerjoin(VerifierIcon,
+                   VerifierProgression.equipped_icon_id == VerifierIcon.id)\
+        .outerjoin(VerifierTitle,
+                   VerifierProgression.equipped_title_id == VerifierTitle.id)\
+        .outerjoin(VerifierQuote,
+                   VerifierProgression.equipped_quote_id == VerifierQuote.id)\
+        .filter(verifiers_filter(include_admins))\
+        .order_by(VerifierProgression.weekly_verifies.desc().nullslast(),
+                  User.id)
+    progression_columns = [
+        c.key for c in VerifierProgression.__table__.columns]
+
+    leaderboard = []
+    for (user_id, name, progression, icon_fa_id, icon_color, icon_title,
+            title, quote) in rows:
+        leaderboard.append(SimpleNamespace(
+            id=user_id,
+            name=name,
+            progression=SimpleNamespace(
+                equipped_icon=SimpleNamespace(
+                    fa_id=icon_fa_id, color=icon_color, title=icon_title)
+                if icon_title is not None else None,
+                equipped_title=SimpleNamespace(title=title)
+                if title is not None else None,
+                equipped_quote=SimpleNamespace(quote=quote)
+                if quote is not None else None,
+                **{c: getattr(progression, c) for c in progression_columns})))
+    return leaderboard
+
+
+def invalidate_leaderboard():
+    leaderboard_cache.invalidate()
+
+
+verification_stats_cache = TTLCache()
+
+
+def get_verification_stats(from_date=None, to_date=None):
+    '''
+    Returns the verification statistics of verify_stats, see
+    query_verification_stats, cached for VERIFY_STATS_CACHE_SECONDS
+    '''
+    return verification_stats_cache.get_or_set(
+        (from_date, to_date),
+        lambda: query_verification_stats(from_date, to_date),
+        app.config['VERIFY_STATS_CACHE_SECONDS'])
+
+
+def verification_stats_columns(from_date=None, to_date=None):
+    '''
+    Returns the labeled COUNT(*) FILTER (WHERE ...) columns shared by
+    the totals and the breakdowns in query_verification_stats
+    '''
+    is_good = and_(
+        Verification.volume_is_low == False,
+        Verification.volume_is_high == False,
+        Verification.recording_has_wrong_wording == False,
+        Verification.recording_has_glitch == False)
+    is_bad = or_(
+        Verification.volume_is_low == True,
+        Verification.volume_is_high == True,
+        Verification.recording_has_wrong_wording == True,
+        Verification.recording_has_glitch == True)
+    week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
+    count = func.count(Verification.id)
+    columns = [
+        count.label('total_count'),
+        count.filter(Verification.is_secondary == True)
+        .label('double_verified'),
+        count.filter(Verification.is_secondary == False)
+        .label('single_verified'),
+        count.filter(Verification.created_at >= week_ago)
+        .label('count_past_week'),
+        count.filter(is_good).label('count_good'),
+        count.filter(is_bad).label('count_bad')]
+    if from_date is not None and to_date is not None:
+        columns.append(count.filter(
+            func.date(Verification.created_at).between(from_date, to_date))
+            .label('count_selection'))
+    return columns
+
+
+def query_verification_stats(from_date=None, to_date=None):
+    '''
+    Returns a dictionary with the number of verifications in total,
+    secondary and primary ones, ones from the past week and good and
+    bad ones, all from one aggregate query. The same numbers are
+    broken down per verifier (by_verifier) and per collection
+    (by_collection), one grouped query each. If from_date and to_date
+    are given, e.g. '2020-01-31', the number of verifications in that
+    range is included as date_selection.
+    '''
+    columns = verification_stats_columns(from_date, to_date)
+    names = [c.key for c in columns]
+
+    totals = db.session.query(*columns).one()
+    verify_stats = dict(zip(names, totals))
+    count_selection = verify_stats.pop('count_selection', None)
+    if count_selection is not None:
+        verify_stats['date_selection'] = {
+            'from': from_date,
+            'to': to_date,
+            'number': count_selection}
+
+    by_verifier = db.session.query(User.id, User.name, *columns)\
+        .select_from(Verification)\
+        .join(User, Verification.verified_by == User.id)\
+        .group_by(User.id, User.name)\
+        .order_by(func.count(Verification.id).desc())
+    verify_stats['by_verifier'] = [
+        dict(zip(['id', 'name'] + names, row)) for row in by_verifier]
+
+    by_collection = db.session.query(Collection.id, Collection.name, *columns)\
+        .select_from(Verification)\
+        .join(Recording, Verification.recording_id == Recording.id)\
+        .join(Token, Recording.token_id == Token.id)\
+        .join(Collection, Token.collection_id == Collection.id)\
+        .group_by(Collection.id, Collection.name)\
+        .order_by(func.count(Verification.id).desc())
+    verify_stats['by_collection'] = [
+        dict(zip(['id', 'name'] + names, row)) for row in by_collection]
+    return verify_stats
 
 
 def add_progression_on_user(user):
@@ -763,6 +1149,7 @@ def insert_trims(trims, verification_id):
     trims is a list of dictionaries sorted in time order, e.g.:
     [{"start":0.6633760683760684,"end":0.9950641025641026},
         {"start":1.1801923076923078,"end":1.6121581196581196}]
+    The trims are added to the current transaction but not committed.
     '''
     trims = json.loads(trims)
     for idx, trim_data in enumerate(trims):
@@ -772,24 +1159,256 @@ def insert_trims(trims, verification_id):
         trim.index = idx
         trim.verification_id = verification_id
         db.session.add(trim)
-    db.session.commit()
 
 
-def activity(model):
+def save_verification(form, progression):
+    '''
+    Adds the verification described by a validated SessionVerifyForm
+    with its trims, marks the recording and, when this was the last
+    recording, the session as verified and rewards the verifier.
+    Returns the id of the verification and a list of the achievements
+    the verifier reached. Everything happens in the current transaction,
+    which is not committed, so a batch of verifications can be written
+    in one go.
+    Input arguments:
+    * form (SessionVerifyForm): The validated verification
+    * progression (VerifierProgression): The progression of the verifier
+    '''
+    is_priority = form.data['isPriority'] == "True"
+    is_secondary = int(form.data['num_verifies']) > 0
+    verification = Verification()
+    verification.set_quality(form.data['quality'])
+    verification.comment = form.data['comment']
+    verification.recording_id = int(form.data['recording'])
+    verification.is_secondary = is_secondary
+    verification.verified_by = int(form.data['verified_by'])
+    db.session.add(verification)
+    db.session.flush()
+    verification_id = verification.id
+    insert_trims(form.data['cut'], verification_id)
+
+    # Everything below happens in the same transaction. The
+    # recording flags are flipped with compare-and-set updates so
+    # the session counters only move once per recording, and the
+    # counter update locks the session row until we commit.
+    recording_id = verification.recording_id
+    num_verified = Recording.query.filter(
+        Recording.id == recording_id,
+        Recording.is_verified.isnot(True))\
+        .update({Recording.is_verified: True},
+                synchronize_session=False)
+    num_secondarily_verified = 0
+    if is_secondary:
+        num_secondarily_verified = Recording.query.filter(
+            Recording.id == recording_id,
+            Recording.is_secondarily_verified.isnot(True))\
+            .update({Recording.is_secondarily_verified: True},
+                    synchronize_session=False)
+
+    # the counters belong to the recording's own session, whichever
+    # session the form names, so a recording verified through a
+    # PrioritySession still counts towards its Session
+    recording_session_id = db.session.query(Recording.session_id)\
+        .filter(Recording.id == recording_id).scalar()
+    own_session = Session.query.filter(Session.id == recording_session_id)
+    if num_verified or num_secondarily_verified:
+        own_session.update({
+            Session.num_verified:
+                Session.num_verified + num_verified,
+            Session.num_secondarily_verified:
+                Session.num_secondarily_verified +
+                num_secondarily_verified},
+            synchronize_session=False)
+    counts = db.session.query(
+        Session.num_recordings, Session.num_verified,
+        Session.num_secondarily_verified)\
+        .filter(Session.id == recording_session_id).first()
+    session_primary_done = session_secondary_done = False
+    if counts is not None:
+        session_primary_done = counts.num_verified >= counts.num_recordings
+        session_secondary_done = \
+            counts.num_secondarily_verified >= counts.num_recordings
+    if is_secondary and session_secondary_done:
+        own_session.filter(Session.is_secondarily_verified.isnot(True))\
+            .update({Session.is_secondarily_verified: True},
+                    synchronize_session=False)
+    session_newly_verified = session_primary_done and own_session\
+        .filter(Session.is_verified.isnot(True))\
+        .update({Session.is_verified: True}, synchronize_session=False)
+
+    # check if this was the final recording of the priority session
+    session_id = int(form.data['session'])
+    if is_priority:
+        model = PrioritySession
+        done = PrioritySession.query.filter(
+            PrioritySession.id == session_id)
+        unverified = Recording.query.filter(
+            Recording.priority_session_id == session_id)
+        if is_secondary and unverified.filter(
+                Recording.is_secondarily_verified.isnot(True))\
+                .count() == 0:
+            done.filter(PrioritySession.is_secondarily_verified.isnot(True))\
+                .update({PrioritySession.is_secondarily_verified: True},
+                        synchronize_session=False)
+        newly_verified = unverified.filter(
+            Recording.is_verified.isnot(True)).count() == 0 and done\
+            .filter(PrioritySession.is_verified.isnot(True))\
+            .update({PrioritySession.is_verified: True},
+                    synchronize_session=False)
+    else:
+        model = Session
+        newly_verified = session_newly_verified
+
+    # every verification keeps the verifier's claim alive
+    renew_session_claim(
+        session_id, verification.verified_by, is_secondary, model)
+
+    achievements = []
+    if newly_verified:
+        progression.num_session_verifies += 1
+        progression.lobe_coins += \
+            app.config['ECONOMY']['session']['coin_reward']
+        progression.experience += \
+            app.config['ECONOMY']['session']['experience_reward']
+
+    # update progression on user
+    progression.lobe_coins += \
+        app.config['ECONOMY']['verification']['coin_reward']
+    progression.experience += \
+        app.config['ECONOMY']['verification']['experience_reward']
+    progression.num_verifies += 1
+    progression.weekly_verifies += 1
+    if not verification.recording_is_good:
+        progression.num_invalid += 1
+
+    # check for achivement updates:
+    # 1. verification:
+    verification_levels = app.config['ECONOMY']['achievements'][
+        'verification'].keys()
+    if progression.verification_level in verification_levels:
+        verification_info = app.config['ECONOMY']['achievements'][
+            'verification'][str(progression.verification_level)]
+        if progression.num_verifies >= verification_info['goal']:
+            progression.verification_level += 1
+            progression.lobe_coins += verification_info['coin_reward']
+            progression.experience += \
+                verification_info['experience_reward']
+            achievements.append('verification')
+    else:
+        pass
+    # 2. bad verifications
+    spy_info = app.config['ECONOMY']['achievements']['spy'][
+        str(progression.spy_level)]
+    if progression.num_invalid >= spy_info['goal']:
+        progression.spy_level += 1
+        progression.lobe_coins += spy_info['coin_reward']
+        progression.experience += spy_info['experience_reward']
+        achievements.append('spy')
+
+    return verification_id, achievements
+
+
+def daily_counts(model, start=None, end=None):
+    '''
+    Counts the rows of model created each day from the start of the
+    day start to the start of the day end, and returns {day: count}
+    for the days with any rows
+    '''
+    day = func.date(model.created_at)
+    counts = db.session.query(day, func.count(model.id))
+    if start is not None:
+        counts = counts.filter(model.created_at >= datetime.datetime.combine(
+            start, datetime.time.min))
+    if end is not None:
+        counts = counts.filter(model.created_at < datetime.datetime.combine(
+            end, datetime.time.min))
+    return {
+        datetime.date.fromisoformat(d) if isinstance(d, str) else d: count
+        for d, count in counts.group_by(day)}
+
+
+def refresh_activity_rollup(model, full=False):
+    '''
+    Brings the ActivityRollup counts of model up to yesterday by
+    counting only the rows created since the last day already rolled
+    up, which is recounted in case it was rolled up early. Days
+    without activity are not stored, except yesterday. Run daily by
+    manage.py rollup_activity. Commits.
+    Input arguments:
+    * model: A model with id and created_at columns, e.g. Verification
+    * full (bool=False): Recount every day, e.g. after rows have been
+    deleted
+    '''
+    entity = model.__tablename__
+    today = datetime.date.today()
+    start = None
+    if not full:
+        start = db.session.query(func.max(ActivityRollup.day))\
+            .filter(ActivityRollup.entity == entity).scalar()
+        if start is not None and start >= today - datetime.timedelta(1):
+            return
+
+    old_rollups = ActivityRollup.query.filter(ActivityRollup.entity == entity)
+    if start is not None:
+        old_rollups = old_rollups.filter(ActivityRollup.day >= start)
+    counts = daily_counts(model, start, today)
+    # yesterday is always stored, with a zero count after an idle day,
+    # so the next refresh today finds the rollup up to date
+    counts.setdefault(today - datetime.timedelta(1), 0)
+
+    try:
+        old_rollups.delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(ActivityRollup, [{
+            'entity': entity, 'day': d, 'count': count}
+            for d, count in counts.items()])
+        db.session.commit()
+    except IntegrityError:
+        # someone else refreshed the same days at the same time
+        db.session.rollback()
+
+
+def activity(model, start=None, end=None):
     '''
     Returns two lists (x, y) where x contains timestamps
     and y contains the number of items of the given model
-    that were created at the given day
-    '''
-    groups = ['year', 'month', 'day']
-    groups = [func.extract(x, model.created_at).label(x) for x in groups]
-    q = (
-            db.session.query(func.count(model.id).label('count'), *groups)
-            .group_by(*groups)
-            .order_by(*groups)
-            .all())
-    x = [
-            (lambda x: f'{int(x.day)}/{int(x.month)}/{int(x.year)}')(el)
-            for el in q]
-    y = [el.count for el in q]
+    that were created at the given day. Days up to the last one in
+    ActivityRollup are read from it and the days after it, usually
+    just today, are counted from the model's table. Nothing is
+    written, the rollup is kept up to date by manage.py
+    rollup_activity.
+    Input arguments:
+    * model: A model with id and created_at columns, e.g. Verification,
+    Recording or Session
+    * start (datetime.date=None): The first day to include
+    * end (datetime.date=None): The last day to include
+    '''
+    entity = model.__tablename__
+    last_rolled_up = db.session.query(func.max(ActivityRollup.day))\
+        .filter(ActivityRollup.entity == entity).scalar()
+
+    days = []
+    if last_rolled_up is not None:
+        q = db.session.query(ActivityRollup.day, ActivityRollup.count)\
+            .filter(
+                ActivityRollup.entity == entity,
+                ActivityRollup.count > 0)\
+            .order_by(ActivityRollup.day)
+        if start is not None:
+            q = q.filter(ActivityRollup.day >= start)
+        if end is not None:
+            q = q.filter(ActivityRollup.day <= end)
+        days = q.all()
+
+    live_start = start
+    if last_rolled_up is not None:
+        live_start = last_rolled_up + datetime.timedelta(1)
+        if start is not None:
+            live_start = max(start, live_start)
+    if end is None or live_start is None or live_start <= end:
+        live_end = end + datetime.timedelta(1) if end is not None else None
+        days.extend(sorted(
+            daily_counts(model, live_start, live_end).items()))
+
+    x = [f'{day.day}/{day.month}/{day.year}' for day, _ in days]
+    y = [count for _, count in days]
     return x, y
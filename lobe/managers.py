@@ -1,15 +1,24 @@
 import datetime
+import io
 import os
 import json
+import shutil
 import zipfile
+import tempfile
 import traceback
 from random import randint
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import current_app as app
+from sqlalchemy.orm import noload, selectinload
 
-
-from lobe.tools.analyze import load_sample, find_segment
-from lobe.models import User, Collection, db
+from lobe.tools.analyze import (load_sample, find_segment, compute_qc_metrics,
+                                write_preview)
+from lobe.tools.waveform import write_peaks
+from lobe.tools.shards import sample_key, write_shard
+from lobe.tools.columnar import ColumnarWriter, has_parquet
+from lobe.models import (
+    User, Collection, Recording, Session, Token, Verification, Trim, db)
 
 
 def pseudo_unique():
@@ -21,6 +30,116 @@ def pseudo_unique():
     return str(randint(10000, 99999))
 
 
+def collection_meta(collection, speaker_ids):
+    meta = {'speakers': [
+        user.get_meta() for user in
+        User.query.filter(User.id.in_(speaker_ids)).order_by(User.id)]}
+    meta['collection'] = collection.get_meta()
+    return meta
+
+
+def recording_info(recording, token, user_name, verifications=None):
+    '''
+    The info.json entry for a single recording. verifications can be
+    passed in to avoid loading recording.verifications.
+    '''
+    if verifications is None:
+        verifications = recording.verifications
+    info = {
+        'collection_info': {
+            'user_name': user_name,
+            'user_id': recording.user_id,
+            'session_id': recording.session_id
+            if recording.session_id is not None else 'n/a'
+        },
+        'text_info': {
+            'id': token.id,
+            'fname': token.get_fname(),
+            'score': token.score,
+            'text': token.text,
+            'pron': token.pron
+        },
+        'recording_info': {
+            'recording_fname': recording.get_zip_fname(),
+            'sr': recording.sr,
+            'num_channels': recording.num_channels,
+            'bit_depth': recording.bit_depth,
+            'duration': recording.duration,
+        },
+        'other': {
+            'transcription': recording.transcription,
+            'recording_marked_bad': recording.marked_as_bad,
+            'text_marked_bad': token.marked_as_bad
+        },
+        'verifications': [
+            verification.dict for verification in verifications],
+    }
+    if recording.start is not None and recording.end is not None:
+        info['recording_info']['start'] = recording.start
+        info['recording_info']['end'] = recording.end
+    return info
+
+
+def collection_export_rows(
+    collection_id,
+    created_after=None,
+    with_details=True,
+    batch_size=1000
+):
+    '''
+    Yields (token, recording, user, verifications) for each recording
+    in the collection, ordered by token. The rows are streamed with
+    yield_per and, if with_details, the users and the verifications
+    (with trims) of each batch are fetched with one query each instead
+    of lazily per recording. Otherwise user and verifications are None.
+    Input arguments:
+    * collection_id (int): The collection
+    * created_after (datetime=None): Only recordings created since
+    * with_details (bool=True): Whether to load users and verifications
+    * batch_size (int=1000): Number of rows per batch
+    '''
+    query = db.session.query(Token, Recording)\
+        .join(Recording, Recording.token_id == Token.id)\
+        .filter(Token.collection_id == collection_id)\
+        .options(noload(Token.recordings))\
+        .order_by(Token.id, Recording.id)
+    if created_after is not None:
+        query = query.filter(Recording.created_at >= created_after)
+    else:
+        query = query.filter(Token.num_recordings > 0)
+
+    users = {}
+
+    def with_batch_details(batch):
+        if not with_details:
+            for token, recording in batch:
+                yield token, recording, None, None
+            return
+        user_ids = set(recording.user_id for _, recording in batch)\
+            .difference(users)
+        if user_ids:
+            users.update(
+                (user.id, user) for user in
+                User.query.filter(User.id.in_(user_ids)))
+        verifications = {recording.id: [] for _, recording in batch}
+        for verification in Verification.query\
+                .filter(Verification.recording_id.in_(verifications))\
+                .options(selectinload(Verification.trims))\
+                .order_by(Verification.id):
+            verifications[verification.recording_id].append(verification)
+        for token, recording in batch:
+            yield (token, recording, users.get(recording.user_id),
+                   verifications[recording.id])
+
+    batch = []
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from with_batch_details(batch)
+            batch = []
+    yield from with_batch_details(batch)
+
+
 class ZipManager:
     def __init__(self, collection):
         self.collection = collection
@@ -44,10 +163,7 @@ class ZipManager:
         self.zf.write(index_path, 'index.tsv')
 
     def add_meta(self, speaker_ids):
-        meta = {'speakers': []}
-        for id in speaker_ids:
-            meta['speakers'].append(User.query.get(id).get_meta())
-        meta['collection'] = self.collection.get_meta()
+        meta = collection_meta(self.collection, speaker_ids)
         meta_f = open(self.meta_path, 'w', encoding='utf-8')
         json.dump(meta, meta_f, ensure_ascii=False, indent=4)
         meta_f.close()
@@ -95,40 +211,9 @@ class RecordingInfoManager:
                 f'info_{pseudo_unique()}.json')
             self.is_closed = False
 
-    def add(self, recording, token, user_name):
-        self.info[recording.id] = {
-            'collection_info': {
-                'user_name': user_name,
-                'user_id': recording.user_id,
-                'session_id': recording.session.id
-                if recording.session else 'n/a'
-            },
-            'text_info': {
-                'id': token.id,
-                'fname': token.get_fname(),
-                'score': token.score,
-                'text': token.text,
-                'pron': token.pron
-            },
-            'recording_info': {
-                'recording_fname': recording.get_zip_fname(),
-                'sr': recording.sr,
-                'num_channels': recording.num_channels,
-                'bit_depth': recording.bit_depth,
-                'duration': recording.duration,
-            },
-            'other': {
-                'transcription': recording.transcription,
-                'recording_marked_bad': recording.marked_as_bad,
-                'text_marked_bad': token.marked_as_bad
-            },
-            'verifications': [verification.dict for verification in recording.verifications],
-        }
-        if recording.start is not None and recording.end is not None:
-            self.info[recording.id]['recording_info']['start']\
-                = recording.start
-            self.info[recording.id]['recording_info']['end']\
-                = recording.end
+    def add(self, recording, token, user_name, verifications=None):
+        self.info[recording.id] = recording_info(
+            recording, token, user_name, verifications=verifications)
 
     def close(self):
         if self.write_file:
@@ -147,41 +232,43 @@ class RecordingInfoManager:
 
 
 def create_collection_info(id):
-    collection = Collection.query.get(id)
-    dl_tokens = [t for t in collection.tokens if t.num_recordings > 0]
-    if not os.path.exists(app.config['TEMP_DIR']):
-        os.makedirs(app.config['TEMP_DIR'])
     recording_info_manager = RecordingInfoManager(id, write_file=False)
-    for token in dl_tokens:
-        for recording in token.recordings:
-            speaker_name = recording.get_user().name
-            recording_info_manager.add(recording, token, speaker_name)
+    for token, recording, user, verifications in collection_export_rows(id):
+        recording_info_manager.add(
+            recording, token, user.name if user else None,
+            verifications=verifications)
     return recording_info_manager.info
 
 
 def create_collection_zip(id):
+    # recordings made while the archive is being built are newer than
+    # zip_created_at and show up as not yet archived
+    created_at = datetime.datetime.now()
     collection = Collection.query.get(id)
-    dl_tokens = [t for t in collection.tokens if t.num_recordings > 0]
     if not os.path.exists(app.config['TEMP_DIR']):
         os.makedirs(app.config['TEMP_DIR'])
     speaker_ids = set()
+    token_ids = set()
     recording_info_manager = RecordingInfoManager(id)
     index_manager = IndexManager()
     zip_manager = ZipManager(collection)
     try:
-        for token in dl_tokens:
-            zip_manager.add_token(token)
-            for recording in token.recordings:
-                speaker_name = recording.get_user().name
-                speaker_ids.add(recording.user_id)
-                # HACK
-                if recording.get_zip_path() is not None:
-                    zip_manager.add_recording(recording, recording.user_id)
-                    recording_info_manager.add(recording, token, speaker_name)
-                    index_manager.add(recording, token, recording.user_id)
-                else:
-                    print(f"Error - token {token.id}",
-                          " does not have a recording")
+        for token, recording, user, verifications in \
+                collection_export_rows(id):
+            if token.id not in token_ids:
+                zip_manager.add_token(token)
+                token_ids.add(token.id)
+            speaker_ids.add(recording.user_id)
+            # HACK
+            if recording.get_zip_path() is not None:
+                zip_manager.add_recording(recording, recording.user_id)
+                recording_info_manager.add(
+                    recording, token, user.name if user else None,
+                    verifications=verifications)
+                index_manager.add(recording, token, recording.user_id)
+            else:
+                print(f"Error - token {token.id}",
+                      " does not have a recording")
 
         index_manager.close()
         recording_info_manager.close()
@@ -207,11 +294,357 @@ def create_collection_zip(id):
 
     # update the zip info for the collection
     collection.has_zip = True
-    collection.zip_token_count = len(dl_tokens)
-    collection.zip_created_at = datetime.datetime.now()
+    collection.zip_token_count = len(token_ids)
+    collection.zip_created_at = created_at
     db.session.commit()
 
 
+def create_collection_shards(
+    id,
+    shard_size=1000,
+    shard_max_mb=1024,
+    num_workers=8
+):
+    '''
+    Exports the collection as tar shards in the WebDataset layout, i.e.
+    paired <key>.wav, <key>.txt and <key>.json members, written in
+    parallel to SHARD_DIR/<id>/ along with a manifest.json. Recordings
+    without a WAV file are stored in their original format, e.g.
+    <key>.webm. The shards are written to a temporary directory that
+    replaces the existing shards of the collection once manifest.json
+    is written, so a failed export leaves them as they were.
+    Input arguments:
+    * id (int): The collection
+    * shard_size (int=1000): Maximum number of samples per shard
+    * shard_max_mb (int=1024): Maximum size of audio per shard in MB
+    * num_workers (int=8): Number of shards written at the same time
+    '''
+    collection = Collection.query.get(id)
+    shard_dir = os.path.join(app.config['SHARD_DIR'], str(id))
+    os.makedirs(app.config['SHARD_DIR'], exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(
+        dir=app.config['SHARD_DIR'], prefix='{}.'.format(id), suffix='.tmp')
+
+    max_bytes = int(shard_max_mb) * 1024 * 1024
+    speaker_ids = set()
+    futures = []
+    shard, shard_bytes = [], 0
+    try:
+        with ThreadPoolExecutor(max_workers=int(num_workers)) as pool:
+            def submit(samples):
+                # keep a bounded number of shards in memory
+                if len(futures) >= 2 * int(num_workers):
+                    futures[-2 * int(num_workers)][1].result()
+                fname = '{}-{:06d}.tar'.format(id, len(futures))
+                futures.append((fname, pool.submit(
+                    write_shard, os.path.join(tmp_dir, fname), samples)))
+
+            for token, recording, user, verifications in \
+                    collection_export_rows(id):
+                if recording.get_zip_path() is None:
+                    continue
+                size = os.path.getsize(recording.get_zip_path())
+                if shard and (len(shard) >= int(shard_size) or
+                              shard_bytes + size > max_bytes):
+                    submit(shard)
+                    shard, shard_bytes = [], 0
+                speaker_ids.add(recording.user_id)
+                shard.append({
+                    'key': sample_key(recording.get_file_id()),
+                    'audio_path': recording.get_zip_path(),
+                    'text': token.text,
+                    'info': recording_info(
+                        recording, token, user.name if user else None,
+                        verifications=verifications)})
+                shard_bytes += size
+            if shard:
+                submit(shard)
+
+        shards = []
+        for fname, future in futures:
+            num_samples, size = future.result()
+            shards.append({
+                'fname': fname, 'num_samples': num_samples, 'size': size})
+        manifest = {
+            'created_at': datetime.datetime.now().isoformat(),
+            'num_samples': sum(s['num_samples'] for s in shards),
+            'shards': shards,
+            'meta': collection_meta(collection, speaker_ids)}
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w',
+                  encoding='utf-8') as manifest_f:
+            json.dump(manifest, manifest_f, ensure_ascii=False, indent=4)
+        os.chmod(tmp_dir, 0o755)
+        old_dir = None
+        if os.path.exists(shard_dir):
+            old_dir = '{}.old{}'.format(shard_dir, pseudo_unique())
+            os.rename(shard_dir, old_dir)
+        os.rename(tmp_dir, shard_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir)
+    except Exception as error:
+        app.logger.error(
+            "Error creating collection shards : {}\n{}".format(
+                error, traceback.format_exc()))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return shard_dir
+
+
+METADATA_TABLES = {
+    'recordings': [
+        ('recording_id', 'int'), ('token_id', 'int'), ('user_id', 'int'),
+        ('session_id', 'int'), ('zip_path', 'str'),
+        ('recording_fname', 'str'), ('created_at', 'datetime'),
+        ('sr', 'int'), ('num_channels', 'int'), ('bit_depth', 'int'),
+        ('duration', 'float'), ('start', 'float'), ('end', 'float'),
+        ('transcription', 'str'), ('marked_as_bad', 'bool'),
+        ('is_verified', 'bool'), ('is_secondarily_verified', 'bool'),
+        ('analysis', 'str'), ('peak_db', 'float'), ('rms_db', 'float'),
+        ('clipping_ratio', 'float'), ('snr_db', 'float'),
+        ('dc_offset', 'float'), ('leading_silence', 'float'),
+        ('trailing_silence', 'float'), ('speech_duration', 'float')],
+    'tokens': [
+        ('token_id', 'int'), ('zip_path', 'str'), ('text_fname', 'str'),
+        ('text', 'str'), ('pron', 'str'), ('score', 'float'),
+        ('marked_as_bad', 'bool'), ('num_recordings', 'int')],
+    'speakers': [
+        ('user_id', 'int'), ('name', 'str'), ('email', 'str'),
+        ('sex', 'str'), ('age', 'int'), ('dialect', 'str')],
+    'verifications': [
+        ('verification_id', 'int'), ('recording_id', 'int'),
+        ('verified_by', 'int'), ('created_at', 'datetime'),
+        ('is_secondary', 'bool'), ('volume_is_low', 'bool'),
+        ('volume_is_high', 'bool'), ('recording_has_glitch', 'bool'),
+        ('recording_has_wrong_wording', 'bool'), ('comment', 'str')],
+    'trims': [
+        ('trim_id', 'int'), ('verification_id', 'int'),
+        ('recording_id', 'int'), ('index', 'int'), ('start', 'float'),
+        ('end', 'float')],
+}
+
+
+def create_collection_metadata(id, batch_size=5000):
+    '''
+    Exports the metadata of the collection as typed columnar tables,
+    Parquet if pyarrow is installed and .npz otherwise, to
+    METADATA_EXPORT_DIR/<id>/ with a manifest.json describing them.
+    The tables are recordings, tokens, speakers, verifications and
+    trims, joined on recording_id, token_id, user_id and
+    verification_id. zip_path is the path of the file in the
+    collection archive.
+    '''
+    collection = Collection.query.get(id)
+    out_dir = os.path.join(app.config['METADATA_EXPORT_DIR'], str(id))
+    os.makedirs(out_dir, exist_ok=True)
+    writers = {
+        name: ColumnarWriter(os.path.join(out_dir, name), schema)
+        for name, schema in METADATA_TABLES.items()}
+
+    recordings = db.session.query(
+        Recording.id, Recording.token_id, Recording.user_id,
+        Recording.session_id, Recording.wav_path, Recording.fname,
+        Recording.created_at, Recording.sr, Recording.num_channels,
+        Recording.bit_depth, Recording.duration, Recording.start,
+        Recording.end, Recording.transcription, Recording.marked_as_bad,
+        Recording.is_verified, Recording.is_secondarily_verified,
+        Recording.analysis, Recording.peak_db, Recording.rms_db,
+        Recording.clipping_ratio, Recording.snr_db, Recording.dc_offset,
+        Recording.leading_silence, Recording.trailing_silence,
+        Recording.speech_duration)\
+        .join(Token, Recording.token_id == Token.id)\
+        .filter(Token.collection_id == id)\
+        .order_by(Recording.id)
+    speaker_ids = set()
+    for row in recordings.yield_per(batch_size):
+        row = list(row)
+        # same name as Recording.get_zip_fname
+        fname = os.path.split(row[4])[1] if row[4] is not None else row[5]
+        row[4:6] = ['audio/{}/{}'.format(row[2], fname), fname]
+        speaker_ids.add(row[2])
+        writers['recordings'].add(row)
+
+    tokens = db.session.query(
+        Token.id, Token.fname, Token.text, Token.pron, Token.score,
+        Token.marked_as_bad, Token.num_recordings)\
+        .filter(Token.collection_id == id, Token.num_recordings > 0)\
+        .order_by(Token.id)
+    for token_id, fname, *rest in tokens.yield_per(batch_size):
+        writers['tokens'].add(
+            [token_id, 'text/{}'.format(fname), fname, *rest])
+
+    for user in User.query.filter(User.id.in_(speaker_ids))\
+            .order_by(User.id):
+        meta = user.get_meta()
+        writers['speakers'].add([
+            meta['id'], meta['name'], meta['email'], meta['sex'],
+            meta['age'], meta['dialect']])
+
+    verifications = db.session.query(
+        Verification.id, Verification.recording_id,
+        Verification.verified_by, Verification.created_at,
+        Verification.is_secondary, Verification.volume_is_low,
+        Verification.volume_is_high, Verification.recording_has_glitch,
+        Verification.recording_has_wrong_wording, Verification.comment)\
+        .join(Recording, Verification.recording_id == Recording.id)\
+        .join(Token, Recording.token_id == Token.id)\
+        .filter(Token.collection_id == id)\
+        .order_by(Verification.id)
+    for row in verifications.yield_per(batch_size):
+        writers['verifications'].add(row)
+
+    trims = db.session.query(
+        Trim.id, Trim.verification_id, Verification.recording_id,
+        Trim.index, Trim.start, Trim.end)\
+        .join(Verification, Trim.verification_id == Verification.id)\
+        .join(Recording, Verification.recording_id == Recording.id)\
+        .join(Token, Recording.token_id == Token.id)\
+        .filter(Token.collection_id == id)\
+        .order_by(Trim.id)
+    for row in trims.yield_per(batch_size):
+        writers['trims'].add(row)
+
+    manifest = {
+        'created_at': datetime.datetime.now().isoformat(),
+        'format': 'parquet' if has_parquet() else 'npz',
+        'collection': collection.get_meta(),
+        'tables': {
+            name: writer.close() for name, writer in writers.items()}}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w',
+              encoding='utf-8') as manifest_f:
+        json.dump(manifest, manifest_f, ensure_ascii=False, indent=4)
+    return out_dir
+
+
+def collection_info_stream(
+    id,
+    fmt='json',
+    only_with_file=False,
+    chunk_size=64*1024
+):
+    '''
+    Generates the collection info in chunks of roughly chunk_size
+    characters, straight from collection_export_rows.
+    Input arguments:
+    * id (int): The collection
+    * fmt (str='json'): 'json' for a single object keyed by recording
+    id, as in info.json, or 'jsonl' for one object per line with the
+    recording id under 'id'
+    * only_with_file (bool=False): Skip recordings without a file, as
+    the archives do
+    * chunk_size (int=64k): Approximate length of each chunk
+    '''
+    buffer, length = [], 0
+    separator = '{'
+    for token, recording, user, verifications in collection_export_rows(id):
+        if only_with_file and recording.get_zip_path() is None:
+            continue
+        info = recording_info(
+            recording, token, user.name if user else None,
+            verifications=verifications)
+        if fmt == 'jsonl':
+            line = json.dumps(
+                {'id': recording.id, **info}, ensure_ascii=False) + '\n'
+        else:
+            line = '{}"{}": {}'.format(
+                separator, recording.id, json.dumps(info, ensure_ascii=False))
+            separator = ', '
+        buffer.append(line)
+        length += len(line)
+        if length >= chunk_size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if fmt != 'jsonl':
+        buffer.append('{}' if separator == '{' else '}')
+    if buffer:
+        yield ''.join(buffer)
+
+
+class ZipStream(io.RawIOBase):
+    '''
+    A write-only, unseekable file object for zipfile.ZipFile. Whatever
+    has been written since the last call to drain() is handed out by it
+    so the archive can be sent while it is being built.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def collection_zip_stream(id, chunk_size=1024*1024):
+    '''
+    Generates the collection archive, with the same layout as
+    create_collection_zip, in chunks without writing anything to disk.
+    Audio is stored as is, text is deflated and index.tsv, info.json
+    and meta.json are written in a second pass over the collection at
+    the end of the archive.
+    '''
+    collection = Collection.query.get(id)
+    stream = ZipStream()
+    speaker_ids = set()
+    try:
+        with zipfile.ZipFile(
+                stream, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+            token_id = None
+            for token, recording, _, _ in collection_export_rows(
+                    id, with_details=False):
+                if token.id != token_id:
+                    zf.write(
+                        token.get_path(), 'text/{}'.format(token.get_fname()))
+                    token_id = token.id
+                    yield stream.drain()
+                if recording.get_zip_path() is None:
+                    continue
+                speaker_ids.add(recording.user_id)
+                zinfo = zipfile.ZipInfo.from_file(
+                    recording.get_zip_path(),
+                    'audio/{}/{}'.format(
+                        recording.user_id, recording.get_zip_fname()))
+                zinfo.compress_type = zipfile.ZIP_STORED
+                with open(recording.get_zip_path(), 'rb') as src, \
+                        zf.open(zinfo, 'w') as dest:
+                    for chunk in iter(lambda: src.read(chunk_size), b''):
+                        dest.write(chunk)
+                        yield stream.drain()
+                yield stream.drain()
+
+            with zf.open('index.tsv', 'w') as index_f:
+                for token, recording, _, _ in collection_export_rows(
+                        id, with_details=False):
+                    if recording.get_zip_path() is not None:
+                        index_f.write('{}\t{}\t{}\n'.format(
+                            recording.user_id, recording.get_zip_fname(),
+                            token.get_fname()).encode('utf-8'))
+                        yield stream.drain()
+            yield stream.drain()
+
+            with zf.open('info.json', 'w') as info_f:
+                for chunk in collection_info_stream(id, only_with_file=True):
+                    info_f.write(chunk.encode('utf-8'))
+                    yield stream.drain()
+            yield stream.drain()
+
+            zf.writestr('meta.json', json.dumps(
+                collection_meta(collection, speaker_ids),
+                ensure_ascii=False, indent=4))
+        yield stream.drain()
+    except Exception as error:
+        app.logger.error(
+            "Error streaming a collection .zip : {}\n{}".format(
+                error, traceback.format_exc()))
+        raise
+
+
 def trim_collection_handler(id, trim_type):
     collection = Collection.query.get(id)
     if trim_type == 2:
@@ -230,3 +663,67 @@ def trim_collection_handler(id, trim_type):
                         top_db=collection.configuration.trim_threshold)
                     recording.set_trim(float(stamps[0]), float(stamps[1]))
     db.session.commit()
+
+
+def create_recording_peaks(recording):
+    '''
+    Computes the waveform peaks of the recording and stores them
+    at recording.get_peaks_path()
+    '''
+    sample, sr = load_sample(recording.get_zip_path())
+    peaks_path = recording.get_peaks_path()
+    os.makedirs(os.path.dirname(peaks_path), exist_ok=True)
+    write_peaks(peaks_path, sample, sr)
+    return peaks_path
+
+
+def create_recording_preview(recording):
+    '''
+    Transcodes the recording to a low bitrate preview for playback
+    and stores it at recording.get_preview_path()
+    '''
+    preview_path = recording.get_preview_path()
+    os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+    write_preview(
+        recording.get_path(), preview_path,
+        bitrate=app.config['PREVIEW_BITRATE'])
+    return preview_path
+
+
+def create_recording_file(create, id):
+    '''
+    Calls create, e.g. create_recording_peaks, with the recording with
+    the given id. Meant to be run by the executor, so errors are logged.
+    '''
+    try:
+        create(Recording.query.get(id))
+    except Exception as error:
+        app.logger.error(
+            "Error in {} for recording {} : {}\n{}".format(
+                create.__name__, id, error, traceback.format_exc()))
+
+
+def process_session_audio(id):
+    '''
+    Decodes each recording in the session once to store its waveform
+    peaks and quality metrics and transcodes it to a preview
+    '''
+    session = Session.query.get(id)
+    for recording in session.recordings:
+        try:
+            sample, sr = load_sample(recording.get_zip_path())
+            peaks_path = recording.get_peaks_path()
+            os.makedirs(os.path.dirname(peaks_path), exist_ok=True)
+            write_peaks(peaks_path, sample, sr)
+            recording.set_qc_metrics(compute_qc_metrics(sample, sr))
+        except Exception as error:
+            app.logger.error(
+                "Error processing audio of recording {} : {}\n{}".format(
+                    recording.id, error, traceback.format_exc()))
+        try:
+            create_recording_preview(recording)
+        except Exception as error:
+            app.logger.error(
+                "Error creating a preview of recording {} : {}\n{}".format(
+                    recording.id, error, traceback.format_exc()))
+    db.session.commit()
@@ -15,7 +15,7 @@ from flask import url_for
 from flask_security import RoleMixin, UserMixin
 from flask_sqlalchemy import SQLAlchemy
 
-from sqlalchemy import func
+from sqlalchemy import and_, case, func
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
 from sqlalchemy.orm import relationship
 from werkzeug import secure_filename
@@ -215,6 +215,39 @@ class Collection(BaseModel, db.Model):
             return round((self.number_of_recordings)
                         * ESTIMATED_AVERAGE_RECORD_LENGTH / 3600, 1)
 
+    def get_recorded_time(self):
+        '''
+        Returns the recorded time in seconds, in total and after trimming,
+        for the whole collection and per speaker, computed from
+        Recording.duration with a single aggregate query. Recordings
+        without a duration are counted in num_missing, see the
+        update_durations command.
+        '''
+        trimmed = case(
+            [(and_(Recording.start != None, Recording.end != None),
+              Recording.end - Recording.start)],
+            else_=Recording.duration)
+        rows = db.session.query(
+            Recording.user_id,
+            func.count(Recording.id),
+            func.count(Recording.duration),
+            func.coalesce(func.sum(Recording.duration), 0),
+            func.coalesce(func.sum(trimmed), 0))\
+            .join(Recording.token)\
+            .filter(Token.collection_id == self.id)\
+            .group_by(Recording.user_id)
+        recorded_time = {
+            'total': 0.0, 'trimmed': 0.0, 'num_missing': 0, 'speakers': {}}
+        for user_id, num, num_with_duration, total, trimmed_total in rows:
+            recorded_time['speakers'][user_id] = {
+                'total': float(total),
+                'trimmed': float(trimmed_total),
+                'num_missing': num - num_with_duration}
+            recorded_time['total'] += float(total)
+            recorded_time['trimmed'] += float(trimmed_total)
+            recorded_time['num_missing'] += num - num_with_duration
+        return recorded_time
+
     @hybrid_property
     def is_closed(self):
         return self.posting is None
@@ -783,7 +816,8 @@ class Recording(BaseModel, db.Model):
         autoincrement=True)
     created_at = db.Column(
         db.DateTime,
-        default=db.func.current_timestamp())
+        default=db.func.current_timestamp(),
+        index=True)
     original_fname = db.Column(
         db.String, default='Unknown')
 
@@ -809,6 +843,17 @@ class Recording(BaseModel, db.Model):
     echo_cancellation = db.Column(db.Boolean)
     noise_suppression = db.Column(db.Boolean)
     analysis = db.Column(db.String)
+    peak_db = db.Column(db.Float)
+    rms_db = db.Column(db.Float)
+    clipping_ratio = db.Column(db.Float, index=True)
+    snr_db = db.Column(db.Float, index=True)
+    dc_offset = db.Column(db.Float)
+    leading_silence = db.Column(db.Float)
+    trailing_silence = db.Column(db.Float)
+    speech_duration = db.Column(db.Float)
+    # the quality metrics couldn't be computed, see manage.py
+    # update_analysis
+    qc_failed = db.Column(db.Boolean, default=False)
     duration = db.Column(db.Float)
     bit_depth = db.Column(db.Integer)
     transcription = db.Column(db.String)
@@ -859,6 +904,9 @@ class Recording(BaseModel, db.Model):
     def get_download_url(self):
         return url_for('recording.download_recording', id=self.id)
 
+    def get_peaks_url(self):
+        return url_for('recording.recording_peaks', id=self.id)
+
     def get_toggle_bad_url(self):
         return url_for('recording.toggle_recording_bad', id=self.id)
 
@@ -874,6 +922,18 @@ class Recording(BaseModel, db.Model):
     def get_wav_path(self):
         return self.wav_path
 
+    def get_peaks_path(self):
+        return os.path.join(
+            app.config['WAVEFORM_DIR'],
+            str(self.token.collection_id),
+            f'{self.get_file_id()}.peaks')
+
+    def get_preview_path(self):
+        return os.path.join(
+            app.config['PREVIEW_DIR'],
+            str(self.token.collection_id),
+            f'{self.get_file_id()}.webm')
+
     def get_zip_fname(self):
         if self.wav_path is not None:
             return os.path.split(self.wav_path)[1]
@@ -963,6 +1023,18 @@ class Recording(BaseModel, db.Model):
         else:
             return "n/a"
 
+    def get_printable_snr(self):
+        if self.snr_db is not None:
+            return "{:2.1f} dB".format(self.snr_db)
+        else:
+            return "n/a"
+
+    def get_printable_clipping(self):
+        if self.clipping_ratio is not None:
+            return "{:2.2f}%".format(self.clipping_ratio * 100)
+        else:
+            return "n/a"
+
     def get_printable_transcription(self):
         if self.transcription is not None and len(self.transcription) > 0:
             return self.transcription
@@ -979,6 +1051,26 @@ class Recording(BaseModel, db.Model):
         self.start = start
         self.end = end
 
+    def set_qc_metrics(self, metrics):
+        '''
+        Stores the output of lobe.tools.analyze.compute_qc_metrics.
+        Leaves analysis alone, it is set by the recorder with the
+        thresholds of the collection configuration.
+        '''
+        self.peak_db = metrics['peak_db']
+        self.rms_db = metrics['rms_db']
+        self.clipping_ratio = metrics['clipping_ratio']
+        self.snr_db = metrics['snr_db']
+        self.dc_offset = metrics['dc_offset']
+        self.leading_silence = metrics['leading_silence']
+        self.trailing_silence = metrics['trailing_silence']
+        self.speech_duration = metrics['speech_duration']
+        self.qc_failed = False
+
+    @property
+    def has_qc_metrics(self):
+        return self.peak_db is not None
+
     @property
     def has_trim(self):
         return self.start is not None and self.end is not None
@@ -1148,7 +1240,8 @@ class Session(BaseModel, db.Model):
     duration = db.Column(db.Float)
     created_at = db.Column(
         db.DateTime,
-        default=db.func.current_timestamp())
+        default=db.func.current_timestamp(),
+        index=True)
     has_video = db.Column(
         db.Boolean,
         default=False)
@@ -1157,6 +1250,10 @@ class Session(BaseModel, db.Model):
         lazy='joined',
         backref='session',
         cascade='all, delete, delete-orphan')
+    # kept up to date with update_numbers and by create_verification
+    num_recordings = db.Column(db.Integer, default=0)
+    num_verified = db.Column(db.Integer, default=0)
+    num_secondarily_verified = db.Column(db.Integer, default=0)
 
     is_secondarily_verified = db.Column(
         db.Boolean,
@@ -1166,7 +1263,9 @@ class Session(BaseModel, db.Model):
         default=False)
     has_priority = db.Column(
         db.Boolean,
-        default=False)
+        default=False,
+        server_default=db.false(),
+        nullable=False)
     verified_by = db.Column(
         db.Integer,
         db.ForeignKey('user.id', ondelete='SET NULL'),
@@ -1175,6 +1274,10 @@ class Session(BaseModel, db.Model):
         db.Integer,
         db.ForeignKey('user.id', ondelete='SET NULL'),
         nullable=True)
+    # when verified_by and secondarily_verified_by claimed the session,
+    # a claim expires VERIFICATION_LEASE_SECONDS after that
+    verification_claimed_at = db.Column(db.DateTime)
+    secondary_verification_claimed_at = db.Column(db.DateTime)
     is_dev = db.Column(
         db.Boolean,
         default=False)
@@ -1185,6 +1288,15 @@ class Session(BaseModel, db.Model):
     def get_url(self):
         return url_for('session.rec_session_detail', id=self.id)
 
+    def update_numbers(self):
+        self.num_recordings, self.num_verified, \
+            self.num_secondarily_verified = db.session.query(
+                func.count(Recording.id),
+                func.count(case([(Recording.is_verified == True, 1)])),
+                func.count(case(
+                    [(Recording.is_secondarily_verified == True, 1)])))\
+            .filter(Recording.session_id == self.id).one()
+
     def get_printable_duration(self):
         if self.duration is not None:
             return str(timedelta(seconds=int(self.duration)))
@@ -1211,10 +1323,6 @@ class Session(BaseModel, db.Model):
             return self.created_at - timedelta(seconds=int(self.duration))
         return None
 
-    @hybrid_property
-    def num_recordings(self):
-        return len(self.recordings)
-
     @hybrid_property
     def get_user(self):
         if self.user_id is not None:
@@ -1228,6 +1336,42 @@ class Session(BaseModel, db.Model):
         return "n/a"
 
 
+# Partial indexes over the sessions that are ready to be claimed for
+# (secondary) verification, in the order they are claimed, and over the
+# claims that may have expired, see lobe.db.claim_session
+db.Index(
+    'ix_Session_verify_ready',
+    Session.has_priority.desc(), Session.id,
+    postgresql_where=and_(
+        Session.is_verified == False, Session.verified_by == None),
+    sqlite_where=and_(
+        Session.is_verified == False, Session.verified_by == None))
+db.Index(
+    'ix_Session_secondary_verify_ready',
+    Session.has_priority.desc(), Session.id,
+    postgresql_where=and_(
+        Session.is_secondarily_verified == False,
+        Session.secondarily_verified_by == None),
+    sqlite_where=and_(
+        Session.is_secondarily_verified == False,
+        Session.secondarily_verified_by == None))
+db.Index(
+    'ix_Session_verify_lease', Session.verification_claimed_at,
+    postgresql_where=and_(
+        Session.is_verified == False, Session.verified_by != None),
+    sqlite_where=and_(
+        Session.is_verified == False, Session.verified_by != None))
+db.Index(
+    'ix_Session_secondary_verify_lease',
+    Session.secondary_verification_claimed_at,
+    postgresql_where=and_(
+        Session.is_secondarily_verified == False,
+        Session.secondarily_verified_by != None),
+    sqlite_where=and_(
+        Session.is_secondarily_verified == False,
+        Session.secondarily_verified_by != None))
+
+
 class PrioritySession(BaseModel, db.Model):
     __tablename__ = 'PrioritySession'
 
@@ -1290,6 +1434,9 @@ class PrioritySession(BaseModel, db.Model):
         db.Integer,
         db.ForeignKey('user.id', ondelete='SET NULL'),
         nullable=True)
+    # see Session.verification_claimed_at
+    verification_claimed_at = db.Column(db.DateTime)
+    secondary_verification_claimed_at = db.Column(db.DateTime)
     is_dev = db.Column(
         db.Boolean,
         default=False)
@@ -1329,6 +1476,17 @@ class PrioritySession(BaseModel, db.Model):
         return "n/a"
 
 
+# see ix_Session_verify_ready
+db.Index(
+    'ix_PrioritySession_verify_ready', PrioritySession.id,
+    postgresql_where=and_(
+        PrioritySession.is_verified == False,
+        PrioritySession.verified_by == None),
+    sqlite_where=and_(
+        PrioritySession.is_verified == False,
+        PrioritySession.verified_by == None))
+
+
 class Verification(BaseModel, db.Model):
     __tablename__ = 'Verification'
 
@@ -1338,7 +1496,8 @@ class Verification(BaseModel, db.Model):
         autoincrement=True)
     created_at = db.Column(
         db.DateTime,
-        default=db.func.current_timestamp())
+        default=db.func.current_timestamp(),
+        index=True)
     verified_by = db.Column(
         db.Integer,
         db.ForeignKey('user.id', ondelete='SET NULL'),
@@ -1432,7 +1591,7 @@ class Verification(BaseModel, db.Model):
             int(self.volume_is_high),
             int(self.recording_has_glitch),
             int(self.recording_has_wrong_wording),
-            self.comment.replace("\n","\\n"),
+            (self.comment or "").replace("\n","\\n"),
         ]))
 
 
@@ -1447,6 +1606,21 @@ class Trim(BaseModel, db.Model):
     verification_id = db.Column(db.Integer, db.ForeignKey('Verification.id'))
 
 
+class ActivityRollup(BaseModel, db.Model):
+    '''
+    The number of rows of a table, e.g. Verification, created on each
+    day before today, see lobe.db.activity
+    '''
+    __tablename__ = 'ActivityRollup'
+    __table_args__ = (
+        db.UniqueConstraint('entity', 'day'),
+      )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(64), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    count = db.Column(db.Integer, default=0)
+
+
 roles_users = db.Table(
     'roles_users',
     db.Column('user_id', db.Integer(), db.ForeignKey('user.id')),
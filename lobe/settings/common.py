@@ -11,9 +11,13 @@ RECORD_DIR = os.path.join(DATA_BASE_DIR, 'records/')
 CUSTOM_RECORDING_DIR = os.path.join(DATA_BASE_DIR, 'custom_recordings/')
 VIDEO_DIR = os.path.join(DATA_BASE_DIR, 'videos/')
 ZIP_DIR = os.path.join(DATA_BASE_DIR, 'zips/')
+SHARD_DIR = os.path.join(DATA_BASE_DIR, 'shards/')
+METADATA_EXPORT_DIR = os.path.join(DATA_BASE_DIR, 'metadata/')
 TEMP_DIR = os.path.join(DATA_BASE_DIR, 'temp/')
 WAV_AUDIO_DIR = os.path.join(DATA_BASE_DIR, 'wav_audio/')
 WAV_CUSTOM_AUDIO_DIR = os.path.join(DATA_BASE_DIR, 'wav_custom_audio/')
+WAVEFORM_DIR = os.path.join(DATA_BASE_DIR, 'waveforms/')
+PREVIEW_DIR = os.path.join(DATA_BASE_DIR, 'previews/')
 
 # Path to the logging file
 LOG_PATH = os.path.join(APP_ROOT, os.pardir, 'logs', 'info.log')
@@ -35,6 +39,26 @@ MOS_PAGINATION = 20
 
 SESSION_SZ = 50
 
+# How long a verifier keeps a claimed session without submitting
+# anything before someone else can claim it
+VERIFICATION_LEASE_SECONDS = 60 * 60
+
+# How long each worker caches the verifier leaderboard
+LEADERBOARD_CACHE_SECONDS = 30
+
+# How long each worker caches the statistics on the verification stats page
+VERIFY_STATS_CACHE_SECONDS = 60
+
+# Bitrate of the Opus previews verifiers listen to instead of the
+# original recordings, see lobe.tools.analyze.write_preview
+PREVIEW_BITRATE = '24k'
+
+# How long browsers may cache files that never change, e.g. waveform peaks
+IMMUTABLE_CACHE_TIMEOUT = 365 * 24 * 60 * 60
+
+# Upper bound in bytes on the blobs posted to the live analysis endpoint
+ANALYZE_MAX_CONTENT_LENGTH = 25 * 1024 * 1024
+
 RECAPTCHA_USE_SSL = False
 RECAPTCHA_DATA_ATTRS = {'theme': 'dark'}
 
@@ -1,5 +1,12 @@
+import io
+import os
+import struct
+import subprocess
+import tempfile
+
 import librosa
 import numpy as np
+import soundfile as sf
 
 
 def load_sample(path: str):
@@ -7,6 +14,136 @@ def load_sample(path: str):
     return y, sr
 
 
+def load_sample_from_bytes(data: bytes):
+    '''
+    Decodes an audio file held in memory, e.g. an uploaded blob, without
+    writing it to disk. Returns the same (y, sr) as load_sample, i.e. a
+    mono float32 signal at the native sample rate.
+
+    Formats supported by libsndfile (wav, flac, ogg) are read directly,
+    anything else (like the webm blobs from the recorder) is decoded by
+    piping it through ffmpeg.
+    '''
+    try:
+        y, sr = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+        y = y.T
+    except RuntimeError:
+        y, sr = _decode_with_ffmpeg(data)
+    return librosa.to_mono(y), sr
+
+
+def ffmpeg_binary():
+    '''
+    ffmpeg is called avconv on Eyra
+    '''
+    if os.getenv('SEMI_PROD', False) or \
+            os.getenv('FLASK_ENV', 'development') == 'production':
+        return 'avconv'
+    return 'ffmpeg'
+
+
+def write_preview(path: str, preview_path: str, bitrate: str = '24k'):
+    '''
+    Transcodes the audio file at path to a mono Opus in WebM preview at
+    preview_path. The preview is written to a uniquely named file next
+    to its final name and then renamed, so a preview that exists is
+    always complete and concurrent transcodes don't clobber each other.
+    Input arguments:
+    * path (str): The original audio file
+    * preview_path (str): Where the preview is stored
+    * bitrate (str='24k'): The Opus bitrate, as given to ffmpeg
+    '''
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(preview_path), suffix='.tmp',
+            delete=False) as tmp_f:
+        tmp_path = tmp_f.name
+    process = subprocess.run(
+        [ffmpeg_binary(), '-loglevel', 'error', '-y', '-i', path,
+         '-vn', '-ac', '1', '-c:a', 'libopus', '-b:a', bitrate,
+         '-application', 'voip', '-f', 'webm', tmp_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise ValueError('Could not transcode audio: {}'.format(
+            process.stderr.decode('utf-8', errors='replace')))
+    os.replace(tmp_path, preview_path)
+
+
+def _decode_with_ffmpeg(data: bytes):
+    '''
+    Pipes data through ffmpeg (avconv on Eyra) and returns a
+    [channels, n] shaped float32 signal and the sample rate. The signal
+    is decoded to 16 bit PCM and scaled the same way librosa scales the
+    output of its ffmpeg fallback.
+    '''
+    process = subprocess.run(
+        [ffmpeg_binary(), '-loglevel', 'error', '-i', 'pipe:0',
+         '-f', 'wav', '-acodec', 'pcm_s16le', 'pipe:1'],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise ValueError('Could not decode audio: {}'.format(
+            process.stderr.decode('utf-8', errors='replace')))
+
+    # The wav header written to a pipe has no valid sizes so we walk the
+    # chunks ourselves and treat everything after 'data' as samples.
+    wav = process.stdout
+    num_channels, sr, offset = None, None, 12
+    while offset + 8 <= len(wav):
+        chunk_id, chunk_size = struct.unpack('<4sI', wav[offset:offset+8])
+        offset += 8
+        if chunk_id == b'fmt ':
+            num_channels, sr = struct.unpack('<xxHI', wav[offset:offset+8])
+        elif chunk_id == b'data':
+            break
+        offset += chunk_size + chunk_size % 2
+    if sr is None:
+        raise ValueError('Could not decode audio: no wav header')
+    pcm = wav[offset:len(wav) - (len(wav) - offset) % (2 * num_channels)]
+    y = librosa.util.buf_to_float(pcm, n_bytes=2, dtype=np.float32)
+    return y.reshape((-1, num_channels)).T, sr
+
+
+def analyze_sample(
+    y: np.ndarray,
+    sr: int,
+    high_thresh: float = -4.5,
+    high_frames: int = 1,
+    low_thresh: float = -15,
+    top_db: float = 10
+):
+    '''
+    Returns the analysis reported to the recorder after each utterance:
+    the volume verdict ('ok', 'high' or 'low') and the suggested trim.
+    '''
+    segment_times = find_segment(y, sr, top_db=top_db)
+    return {
+        'analysis': volume_analysis(y, high_thresh, high_frames, low_thresh),
+        'segment': {
+            'start': float(segment_times[0]),
+            'end': float(segment_times[1])
+        }
+    }
+
+
+def volume_analysis(
+    y: np.ndarray,
+    high_thresh: float = -4.5,
+    high_frames: int = 1,
+    low_thresh: float = -15
+):
+    '''
+    Returns the volume verdict, 'ok', 'high' or 'low', stored in
+    Recording.analysis. The thresholds should come from the
+    configuration of the collection, as they do in the recorder.
+    '''
+    if signal_is_too_high(y, thresh=high_thresh, num_frames=high_frames):
+        return 'high'
+    if signal_is_too_low(y, thresh=low_thresh):
+        return 'low'
+    return 'ok'
+
+
 def find_segment(
     y: np.ndarray,
     sr: int,
@@ -43,6 +180,96 @@ def check_sample(y: np.ndarray, checks: list):
     return False
 
 
+def compute_qc_metrics(
+    y: np.ndarray,
+    sr: int,
+    frame_ms: int = 25,
+    top_db: float = 30,
+    clip_thresh: float = 0.999
+):
+    '''
+    Computes all quality metrics of a recording in a single vectorized
+    pass over the signal. Returns a dictionary with:
+    * peak_db: the peak level in dBFS
+    * rms_db: the RMS level of the whole signal in dBFS
+    * clipping_ratio: the ratio of samples at or above clip_thresh
+    * snr_db: the estimated SNR, i.e. the mean power of speech frames
+    over the mean power of non-speech frames
+    * dc_offset: the mean of the signal
+    * leading_silence, trailing_silence: seconds before the first and
+    after the last speech frame
+    * speech_duration: the total length of speech frames in seconds
+    The volume verdict in Recording.analysis depends on the collection
+    configuration and is not part of these, see volume_analysis.
+    Input arguments:
+    * y (np.ndarray): A [n] shaped numpy array containing the signal
+    * sr (int): The sample rate of the signal
+    * frame_ms (int=25): Length of the non-overlapping analysis frames
+    * top_db (float=30): Frames more than top_db below the loudest
+    frame are considered silence
+    * clip_thresh (float=0.999): Absolute amplitude counted as clipped
+    '''
+    eps = 1e-10
+    duration = len(y) / sr
+    if len(y) == 0:
+        return {
+            'peak_db': None, 'rms_db': None, 'clipping_ratio': 0.0,
+            'snr_db': None, 'dc_offset': 0.0, 'leading_silence': 0.0,
+            'trailing_silence': 0.0, 'speech_duration': 0.0}
+
+    abs_y = np.abs(y)
+    peak = float(abs_y.max())
+    dc_offset = float(y.mean())
+    power = np.square(y - dc_offset, dtype=np.float64)
+
+    frame_sz = max(1, int(sr * frame_ms / 1000))
+    num_frames = int(np.ceil(len(y) / frame_sz))
+    frame_power = np.zeros(num_frames * frame_sz)
+    frame_power[:len(y)] = power
+    frame_power = frame_power.reshape((num_frames, frame_sz)).mean(axis=1)
+    frame_db = 10 * np.log10(frame_power + eps)
+
+    is_speech = frame_db > frame_db.max() - top_db
+    speech_idx = np.flatnonzero(is_speech)
+    if len(speech_idx) < num_frames:
+        snr_db = float(
+            10 * np.log10(frame_power[is_speech].mean() + eps) -
+            10 * np.log10(frame_power[~is_speech].mean() + eps))
+    else:
+        # no silence to estimate the noise floor from
+        snr_db = None
+
+    frame_len = frame_sz / sr
+    return {
+        'peak_db': float(20 * np.log10(peak + eps)),
+        'rms_db': float(10 * np.log10(power.mean() + eps)),
+        'clipping_ratio': float(np.count_nonzero(
+            abs_y >= clip_thresh) / len(y)),
+        'snr_db': snr_db,
+        'dc_offset': dc_offset,
+        'leading_silence': min(speech_idx[0] * frame_len, duration),
+        'trailing_silence': max(
+            duration - (speech_idx[-1] + 1) * frame_len, 0.0),
+        'speech_duration': min(len(speech_idx) * frame_len, duration)}
+
+
+def analyze_file(path: str, volume_thresholds: dict = None):
+    '''
+    Loads the file at path and returns its quality metrics. Module level
+    so it can be handed to a process pool.
+    Input arguments:
+    * path (str): The audio file
+    * volume_thresholds (dict=None): If given, the volume verdict is
+    added as 'analysis', computed with these keyword arguments of
+    volume_analysis
+    '''
+    y, sr = load_sample(path)
+    metrics = compute_qc_metrics(y, sr)
+    if volume_thresholds is not None:
+        metrics['analysis'] = volume_analysis(y, **volume_thresholds)
+    return metrics
+
+
 def signal_is_too_high(
     y: np.ndarray,
     thresh: float = -4.5,
@@ -56,16 +283,13 @@ def signal_is_too_high(
     * thresh (float=-4.5): A db threshold
     * num_frames (int=20): A number of frames
     '''
-    db = librosa.amplitude_to_db(y)
-    thresh_count = 0
-    for i in range(len(db)):
-        if db[i] > thresh:
-            thresh_count += 1
-            if thresh_count == num_frames:
-                return True
-        else:
-            thresh_count = 0
-    return False
+    above = librosa.amplitude_to_db(y) > thresh
+    if num_frames <= 1:
+        return bool(above.any())
+    # the length of the longest run of consecutive frames above thresh
+    edges = np.diff(np.concatenate(([0], above.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return bool(len(starts) and (ends - starts).max() >= num_frames)
 
 
 def signal_is_too_low(y: np.ndarray, thresh: float = -15):
@@ -75,5 +299,4 @@ def signal_is_too_low(y: np.ndarray, thresh: float = -15):
     * y (np.ndarray): A [n] shaped numpy array containing the signal
     * thresh (float=-18): A db threshold
     '''
-    db = librosa.amplitude_to_db(y)
-    return not any(db_val > thresh for db_val in db)
+    return not bool((librosa.amplitude_to_db(y) > thresh).any())
@@ -0,0 +1,58 @@
+import threading
+import time
+
+
+class TTLCache:
+    '''
+    A small thread safe in-process cache where every value expires
+    after the ttl it was set with. Each worker process has its own
+    cache, so invalidate only clears the calling worker and other
+    workers catch up when their values expire. Values should therefore
+    be safe to serve a few seconds stale and must not be bound to a
+    database session, i.e. plain values and not model instances.
+    '''
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires_at = self._values.get(key, (default, None))
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._values[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl):
+        '''
+        Input arguments:
+        * key: Any hashable key
+        * value: The value to cache
+        * ttl (float): Seconds until the value expires
+        '''
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl)
+
+    def get_or_set(self, key, create, ttl):
+        '''
+        Returns the cached value of key, or creates it by calling
+        create() and caches it for ttl seconds if it is missing or has
+        expired. Concurrent misses may all call create().
+        '''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = create()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        '''
+        Drops the value of key, or every value if no key is given
+        '''
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is in requirements.txt, installs without it write the
+    # tables as .npz, which keeps every column in memory until close
+    pa = None
+
+NPZ_DTYPES = {
+    'int': np.int64,
+    'float': np.float64,
+    'bool': np.bool_,
+    'str': np.str_,
+    'datetime': 'datetime64[ms]'}
+NPZ_NULLS = {
+    'int': -1,
+    'float': np.nan,
+    'bool': False,
+    'str': '',
+    'datetime': None}
+
+
+def has_parquet():
+    return pa is not None
+
+
+class ColumnarWriter:
+    '''
+    Writes rows to a typed columnar file, Parquet if pyarrow is
+    installed, otherwise a NumPy .npz archive with one array per
+    column. Parquet files are written one row group per batch_size
+    rows. In the .npz files missing values are stored as -1 for int
+    columns, NaN for floats, False for bools, '' for strings and NaT
+    for datetimes.
+    Input arguments:
+    * path (str): The path of the file without an extension
+    * schema (list): A list of (column name, type) tuples where the
+    type is one of 'int', 'float', 'bool', 'str' or 'datetime'
+    * batch_size (int=50000): Number of rows per Parquet row group
+    '''
+    def __init__(self, path: str, schema: list, batch_size: int = 50000):
+        self.schema = schema
+        self.batch_size = batch_size
+        self.columns = [[] for _ in schema]
+        self.num_rows = 0
+        if has_parquet():
+            self.path = f'{path}.parquet'
+            self.arrow_schema = pa.schema([
+                (name, {
+                    'int': pa.int64(),
+                    'float': pa.float64(),
+                    'bool': pa.bool_(),
+                    'str': pa.string(),
+                    'datetime': pa.timestamp('ms')}[column_type])
+                for name, column_type in schema])
+            self.writer = pq.ParquetWriter(self.path, self.arrow_schema)
+        else:
+            self.path = f'{path}.npz'
+
+    def add(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.num_rows += 1
+        if has_parquet() and len(self.columns[0]) >= self.batch_size:
+            self._write_batch()
+
+    def _write_batch(self):
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field
+             in zip(self.columns, self.arrow_schema)],
+            schema=self.arrow_schema))
+        self.columns = [[] for _ in self.schema]
+
+    def close(self):
+        if has_parquet():
+            if self.columns[0] or self.num_rows == 0:
+                self._write_batch()
+            self.writer.close()
+        else:
+            arrays = {}
+            for (name, column_type), column in zip(self.schema, self.columns):
+                null = NPZ_NULLS[column_type]
+                arrays[name] = np.array(
+                    [null if value is None else value for value in column],
+                    dtype=NPZ_DTYPES[column_type])
+            with open(self.path, 'wb') as npz_f:
+                np.savez_compressed(npz_f, **arrays)
+        return {
+            'fname': os.path.basename(self.path),
+            'num_rows': self.num_rows,
+            'columns': dict(self.schema)}
+
@@ -1,57 +1,208 @@
+import contextlib
+import errno
+import fcntl
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 
+import numpy as np
+
+# ioctl request for cloning a file on copy-on-write filesystems, e.g.
+# btrfs and xfs, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
 
 def ds_to_merlinformat(
     src_dir: str,
     out_dir: str,
     use_json: bool = True,
-    speaker_name: str = None
+    speaker_name: str = None,
+    manifest_path: str = None,
+    num_workers: int = 16
 ):
     '''
     Convert an exported dataset to a Merlin compatible
     dataset by creating a new collection at out_dir where
     each .token has been renamed to take the same name as
     the corresponding .wav.
+    Input arguments:
+    * src_dir (str): An extracted collection archive or the output of
+    manage.py download_collection
+    * out_dir (str): Where the Merlin dataset is created, must not exist
+    * use_json (bool=True): Read the pairs from info.json, otherwise
+    from the columnar tables in manifest_path if given, otherwise from
+    index.tsv
+    * speaker_name (str=None): The audio directory for an index.tsv
+    without a speaker column
+    * manifest_path (str=None): The manifest.json written by
+    manage.py export_metadata for this collection
+    * num_workers (int=16): Number of files linked or copied at once
+    '''
+    if use_json:
+        pairs = merlin_pairs_from_info(src_dir)
+    elif manifest_path is not None:
+        pairs = merlin_pairs_from_manifest(src_dir, manifest_path)
+    else:
+        pairs = merlin_pairs_from_index(src_dir, speaker_name=speaker_name)
+    return write_merlinformat(pairs, out_dir, num_workers=num_workers)
+
+
+def write_merlinformat(pairs, out_dir: str, num_workers: int = 16):
+    '''
+    Creates out_dir/wav/<name>.wav and out_dir/txt/<name>.txt for each
+    (wav path, text path) pair, linking the files where possible.
     '''
     if os.path.exists(out_dir):
         print("out_dir exists on disk, returning")
         return False
-    else:
-        txt_dir = os.path.join(out_dir, 'txt')
-        wav_dir = os.path.join(out_dir, 'wav')
-        os.makedirs(txt_dir)
-        os.makedirs(wav_dir)
+    txt_dir = os.path.join(out_dir, 'txt')
+    wav_dir = os.path.join(out_dir, 'wav')
+    os.makedirs(txt_dir)
+    os.makedirs(wav_dir)
 
-    if use_json:
-        with open(os.path.join(src_dir, 'info.json')) as json_f:
-            info = json.load(json_f)
-            for record_id, item in info.items():
-                wav_fname = item['collection_info']['recording_fname']
-                txt_fname = item['collection_info']['text_fname']
-                speaker_name = item['collection_info']['user_name']
-                copy_to_merlin(src_dir, wav_dir, txt_dir, wav_fname, txt_fname,
-                               speaker_name)
-    else:
-        with open(os.path.join(src_dir, 'index.tsv')) as index:
-            for line in index:
-                wav_fname, txt_fname = line.split('\t')
-                copy_to_merlin(src_dir, wav_fname, txt_fname, speaker_name)
+    jobs = []
+    for wav_path, txt_path in pairs:
+        wav_fname = os.path.basename(wav_path)
+        jobs.append((wav_path, os.path.join(wav_dir, wav_fname)))
+        jobs.append((txt_path, os.path.join(
+            txt_dir, "{}.txt".format(os.path.splitext(wav_fname)[0]))))
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(pool.map(lambda job: link_or_copy(*job), jobs))
+    return True
 
 
-def copy_to_merlin(
-    src_dir: str,
-    wav_dir: str,
-    txt_dir: str,
-    wav_fname: str,
-    txt_fname: str,
-    speaker_name: str
-):
-    ident = os.path.splitext(wav_fname)[0]
-    copyfile(
-        os.path.join(src_dir, 'audio', speaker_name, wav_fname),
-        os.path.join(wav_dir, wav_fname))
-    copyfile(
-        os.path.join(src_dir, 'text', txt_fname.strip()),
-        os.path.join(txt_dir, "{}.txt".format(ident)))
\ No newline at end of file
+def merlin_pairs_from_info(src_dir: str):
+    '''
+    Reads the (wav path, text path) pairs from info.json. Both the
+    archive layout, where audio is stored under the user id and the
+    text file name is in text_info, and the older layout of
+    download_collection, with user names and collection_info.text_fname,
+    are supported.
+    '''
+    with open(os.path.join(src_dir, 'info.json')) as json_f:
+        info = json.load(json_f)
+    pairs = []
+    for item in info.values():
+        collection_info = item['collection_info']
+        if 'text_info' in item:
+            wav_fname = item['recording_info']['recording_fname']
+            txt_fname = item['text_info']['fname']
+        else:
+            wav_fname = collection_info['recording_fname']
+            txt_fname = collection_info['text_fname']
+        speaker_dir = os.path.join(
+            src_dir, 'audio', str(collection_info['user_id']))
+        if not os.path.exists(speaker_dir):
+            if collection_info.get('user_name') is None:
+                raise ValueError(
+                    'No audio directory {} and no user name to fall back '
+                    'to for {}'.format(speaker_dir, wav_fname))
+            speaker_dir = os.path.join(
+                src_dir, 'audio', collection_info['user_name'])
+        pairs.append((
+            os.path.join(speaker_dir, wav_fname),
+            os.path.join(src_dir, 'text', txt_fname)))
+    return pairs
+
+
+def merlin_pairs_from_index(src_dir: str, speaker_name: str = None):
+    '''
+    Reads the (wav path, text path) pairs from index.tsv, either with
+    the speaker directory as the first column, as in the archives, or
+    without it in which case speaker_name is used and must be given.
+    '''
+    pairs = []
+    with open(os.path.join(src_dir, 'index.tsv')) as index:
+        for line_num, line in enumerate(index, start=1):
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) == 3:
+                speaker_dir, wav_fname, txt_fname = columns
+            elif len(columns) == 2:
+                if speaker_name is None:
+                    raise ValueError(
+                        'index.tsv has no speaker column, speaker_name '
+                        'must be given')
+                speaker_dir, (wav_fname, txt_fname) = speaker_name, columns
+            else:
+                raise ValueError(
+                    'Line {} of index.tsv has {} columns, expected 2 or '
+                    '3'.format(line_num, len(columns)))
+            pairs.append((
+                os.path.join(src_dir, 'audio', speaker_dir, wav_fname),
+                os.path.join(src_dir, 'text', txt_fname)))
+    return pairs
+
+
+def merlin_pairs_from_manifest(src_dir: str, manifest_path: str):
+    '''
+    Reads the (wav path, text path) pairs from the recordings and
+    tokens tables of a columnar metadata export. Their zip_path
+    columns are relative to the extracted archive at src_dir.
+    '''
+    with open(manifest_path) as manifest_f:
+        tables = json.load(manifest_f)['tables']
+    table_dir = os.path.dirname(manifest_path)
+    recordings = read_columns(
+        os.path.join(table_dir, tables['recordings']['fname']),
+        ['token_id', 'zip_path'])
+    tokens = read_columns(
+        os.path.join(table_dir, tables['tokens']['fname']),
+        ['token_id', 'zip_path'])
+    token_paths = dict(zip(tokens['token_id'], tokens['zip_path']))
+    return [
+        (os.path.join(src_dir, zip_path),
+         os.path.join(src_dir, token_paths[token_id]))
+        for token_id, zip_path in zip(
+            recordings['token_id'], recordings['zip_path'])
+        if token_id in token_paths]
+
+
+def read_columns(path: str, columns: list):
+    '''
+    Reads the given columns of a table written by
+    lobe.tools.columnar.ColumnarWriter into a dictionary of lists
+    '''
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns).to_pydict()
+    with np.load(path) as table:
+        return {column: table[column].tolist() for column in columns}
+
+
+def link_or_copy(src: str, dst: str, resume: bool = False):
+    '''
+    Puts a copy of src at dst as cheaply as possible: a reflink if the
+    filesystem supports it, otherwise a hardlink if src and dst are on
+    the same filesystem, otherwise a regular copy. Returns which one of
+    'skipped', 'reflinked', 'linked' or 'copied' was done.
+    Input arguments:
+    * src (str): The source path
+    * dst (str): The destination path, its directory must exist
+    * resume (bool=False): If True, a file at dst with the same size
+    as src is assumed to be done already and is skipped
+    '''
+    if os.path.lexists(dst):
+        if resume and os.path.getsize(dst) == os.path.getsize(src):
+            return 'skipped'
+        os.remove(dst)
+
+    try:
+        with open(src, 'rb') as src_f, open(dst, 'wb') as dst_f:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        return 'reflinked'
+    except OSError:
+        # dst is never created if src couldn't be opened
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return 'linked'
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                               errno.ENOTSUP):
+            raise
+
+    copyfile(src, dst)
+    return 'copied'
@@ -0,0 +1,38 @@
+from flask import current_app as app
+from flask import send_from_directory
+
+
+def send_cached_file(
+    directory: str,
+    filename: str,
+    immutable: bool = False,
+    private: bool = True,
+    **options
+):
+    '''
+    send_from_directory with conditional requests turned on, i.e.
+    ETag/If-None-Match, Last-Modified/If-Modified-Since and byte ranges
+    (Range/If-Range) so interrupted downloads can be resumed.
+    Input arguments:
+    * directory (str): The directory of the file
+    * filename (str): The name of the file within directory
+    * immutable (bool=False): The file never changes once written, so
+    clients may cache it for IMMUTABLE_CACHE_TIMEOUT without asking
+    again. Otherwise they have to revalidate with the ETag each time.
+    * private (bool=True): Only the client may cache the response, not
+    shared caches. Should be set for everything behind a login.
+    * options: passed on to send_from_directory, e.g. as_attachment
+    '''
+    response = send_from_directory(
+        directory, filename,
+        conditional=True,
+        cache_timeout=app.config['IMMUTABLE_CACHE_TIMEOUT']
+        if immutable else 0,
+        **options)
+    response.cache_control.public = not private
+    response.cache_control.private = private
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
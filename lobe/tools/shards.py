@@ -0,0 +1,42 @@
+import io
+import json
+import os
+import tarfile
+import time
+
+
+def sample_key(file_id: str):
+    '''
+    WebDataset splits the file names of a sample at the first dot, so
+    the key itself can't contain any
+    '''
+    return file_id.replace('.', '_')
+
+
+def write_shard(path: str, samples: list):
+    '''
+    Writes a tar shard where each sample is stored as three
+    consecutive members sharing a key: the audio, named by the
+    extension of its file, e.g. <key>.wav, <key>.txt and <key>.json.
+    Returns the number of samples and the size of the shard in bytes.
+    Input arguments:
+    * path (str): Where the shard should be written
+    * samples (list): A list of dictionaries with the keys 'key',
+    'audio_path', 'text' and 'info'
+    '''
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    mtime = time.time()
+    with tarfile.open(tmp_path, 'w') as tar:
+        for sample in samples:
+            ext = os.path.splitext(sample['audio_path'])[1].lower()
+            tar.add(sample['audio_path'], arcname=f"{sample['key']}{ext}")
+            for ext, data in (
+                    ('txt', sample['text']),
+                    ('json', json.dumps(sample['info'], ensure_ascii=False))):
+                data = data.encode('utf-8')
+                member = tarfile.TarInfo(f"{sample['key']}.{ext}")
+                member.size = len(data)
+                member.mtime = mtime
+                tar.addfile(member, io.BytesIO(data))
+    os.replace(tmp_path, path)
+    return len(samples), os.path.getsize(path)
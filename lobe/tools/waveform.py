@@ -0,0 +1,85 @@
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+PEAKS_MAGIC = b'LPK1'
+BUCKET_MS = 10
+ZOOM_FACTORS = (1, 4, 16, 64)
+
+
+def compute_peaks(
+    y: np.ndarray,
+    sr: int,
+    bucket_ms: int = BUCKET_MS,
+    zoom_factors: tuple = ZOOM_FACTORS
+):
+    '''
+    Returns a list with one [n, 2] shaped int8 array per zoom level
+    containing the (min, max) of the signal in each bucket. The first
+    level has one bucket per bucket_ms, the others merge zoom_factor
+    buckets of the first one.
+    Input arguments:
+    * y (np.ndarray): A [n] shaped numpy array containing the signal
+    * sr (int): The sample rate of the signal
+    * bucket_ms (int=10): The length of the finest buckets in ms
+    * zoom_factors (tuple): The number of finest buckets per bucket
+    for each zoom level
+    '''
+    bucket_sz = max(1, int(sr * bucket_ms / 1000))
+    num_buckets = int(np.ceil(len(y) / bucket_sz))
+    if num_buckets == 0:
+        return [np.zeros((0, 2), dtype=np.int8) for _ in zoom_factors]
+
+    frames = np.zeros(num_buckets * bucket_sz, dtype=np.float32)
+    frames[:len(y)] = y
+    frames = frames.reshape((num_buckets, bucket_sz))
+    mins, maxs = frames.min(axis=1), frames.max(axis=1)
+
+    levels = []
+    for factor in zoom_factors:
+        num_level_buckets = int(np.ceil(num_buckets / factor))
+        pad = num_level_buckets * factor - num_buckets
+        level_mins = np.pad(mins, (0, pad), mode='edge')\
+            .reshape((num_level_buckets, factor)).min(axis=1)
+        level_maxs = np.pad(maxs, (0, pad), mode='edge')\
+            .reshape((num_level_buckets, factor)).max(axis=1)
+        level = np.stack([level_mins, level_maxs], axis=1)
+        levels.append(
+            np.clip(np.round(level * 127), -127, 127).astype(np.int8))
+    return levels
+
+
+def write_peaks(
+    path: str,
+    y: np.ndarray,
+    sr: int,
+    bucket_ms: int = BUCKET_MS,
+    zoom_factors: tuple = ZOOM_FACTORS
+):
+    '''
+    Writes the peaks of the signal to path in the following little
+    endian layout:
+    * header: magic (4s), sample rate (I), number of samples (I),
+    bucket length in ms (H), number of zoom levels (H)
+    * for each zoom level: zoom factor (H), number of buckets (I)
+    * for each zoom level: the (min, max) int8 pairs of each bucket
+    '''
+    levels = compute_peaks(y, sr, bucket_ms=bucket_ms,
+                           zoom_factors=zoom_factors)
+    # write to a uniquely named temporary file first so readers never
+    # see half a file and concurrent writers don't clobber each other
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), suffix='.tmp', delete=False) as peaks_f:
+        try:
+            peaks_f.write(struct.pack(
+                '<4sIIHH', PEAKS_MAGIC, sr, len(y), bucket_ms, len(levels)))
+            for factor, level in zip(zoom_factors, levels):
+                peaks_f.write(struct.pack('<HI', factor, len(level)))
+            for level in levels:
+                peaks_f.write(level.tobytes())
+        except Exception:
+            os.remove(peaks_f.name)
+            raise
+    os.replace(peaks_f.name, path)
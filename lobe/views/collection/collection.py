@@ -1,10 +1,10 @@
 import os
 import traceback
 import shutil
-import json
+import zlib
 from zipfile import ZipFile
 from flask import (Blueprint, redirect, url_for, request, render_template,
-                   flash, send_from_directory, Response)
+                   flash, Response, stream_with_context)
 from flask import current_app as app
 from flask_security import login_required, roles_accepted
 
@@ -15,8 +15,11 @@ from lobe.db import (
 from lobe.forms import (
     CollectionForm, BulkTokenForm, collection_edit_form, UploadCollectionForm)
 from lobe.tools.pagination import ListPagination
+from lobe.tools.http import send_cached_file
 from lobe.managers import (
-    trim_collection_handler, create_collection_zip, create_collection_info)
+    trim_collection_handler, create_collection_zip,
+    collection_info_stream, collection_zip_stream, create_collection_shards,
+    create_collection_metadata)
 
 collection = Blueprint(
     'collection', __name__, template_folder='templates')
@@ -136,6 +139,7 @@ def collection_detail(id):
             token_form.is_g2p.data)
 
     collection = Collection.query.get(id)
+    recorded_time = collection.get_recorded_time()
     recorded_users = []
     all_users = collection.users
     nums = collection.get_users_number_of_recordings([u.id for u in all_users])
@@ -149,6 +153,8 @@ def collection_detail(id):
         json_user = {'user': u,
                     'number_of_recordings': num,
                     'time_estimate': collection.get_user_time_estimate(u.id, num_recordings=num),
+                    'recorded_hours': round(recorded_time['speakers'].get(
+                        u.id, {'total': 0})['total'] / 3600, 2),
                     'percentage': round((num/collection.num_tokens)*100)
                     }
 
@@ -168,6 +174,7 @@ def collection_detail(id):
         collection=collection,
         token_form=token_form,
         recorded_users=recorded_users,
+        recorded_time=recorded_time,
         tokens=tokens,
         users=User.query.order_by(User.name).all(),
         section='collection')
@@ -212,21 +219,64 @@ def generate_zip(id):
     return redirect(url_for('collection.collection_detail', id=id))
 
 
+@collection.route('/collections/<int:id>/generate_shards')
+@login_required
+@roles_accepted('admin')
+def generate_shards(id):
+    app.executor.submit(create_collection_shards, id)
+    flash('Gagnasafn í bútum verður tilbúið vonbráðar.', category='success')
+    return redirect(url_for('collection.collection_detail', id=id))
+
+
+@collection.route('/collections/<int:id>/generate_metadata')
+@login_required
+@roles_accepted('admin')
+def generate_metadata(id):
+    app.executor.submit(create_collection_metadata, id)
+    flash('Lýsigögn verða tilbúin vonbráðar.', category='success')
+    return redirect(url_for('collection.collection_detail', id=id))
+
+
+@collection.route('/collections/<int:id>/metadata/<string:fname>')
+@login_required
+@roles_accepted('admin')
+def download_collection_metadata(id, fname):
+    '''
+    Serves the manifest.json and the tables written by
+    generate_metadata
+    '''
+    return send_cached_file(
+        os.path.join(app.config['METADATA_EXPORT_DIR'], str(id)), fname,
+        as_attachment=True)
+
+
 @collection.route('/collections/<int:id>/stream_zip')
 @login_required
 @roles_accepted('admin')
 def stream_collection_zip(id):
     collection = Collection.query.get(id)
-    zip_file = open(collection.zip_path, 'rb')
-    file_size = os.path.getsize(collection.zip_path)
+    # archives are updated in place, so clients revalidate with the ETag
+    # and resume interrupted downloads with If-Range
+    return send_cached_file(
+        os.path.dirname(collection.zip_path), collection.zip_fname,
+        mimetype='application/octet-stream', as_attachment=True)
+
+
+@collection.route('/collections/<int:id>/stream_zip_live')
+@login_required
+@roles_accepted('admin')
+def stream_collection_zip_live(id):
+    '''
+    Builds the archive while it is being downloaded instead of serving
+    the one made by generate_zip
+    '''
+    collection = Collection.query.get(id)
     return Response(
-        zip_file,
-        mimetype='application/octet-stream',
+        stream_with_context(collection_zip_stream(id)),
+        mimetype='application/zip',
         headers=[
-            ('Content-Length', str(file_size)),
             ('Content-Disposition',
-                f"attachment; filename=\"{collection.zip_fname}\"")],
-        direct_passthrough=True)
+                f"attachment; filename=\"{collection.zip_fname}\"")])
 
 
 @collection.route('/collections/stream_collection_demo')
@@ -235,7 +285,7 @@ def stream_collection_zip(id):
 def stream_collection_index_demo():
     other_dir = app.config["OTHER_DIR"]
     try:
-        return send_from_directory(
+        return send_cached_file(
             other_dir, 'synidaemi_collection.zip',
             as_attachment=True)
     except Exception as error:
@@ -244,25 +294,43 @@ def stream_collection_index_demo():
                 error, traceback.format_exc()))
 
 
+def gzip_stream(chunks):
+    '''
+    gzip compresses a stream of str chunks on the fly
+    '''
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 @collection.route('/collections/<int:id>/collection_info')
 @login_required
 @roles_accepted('admin')
 def download_collection_info(id):
-    info = create_collection_info(id)
-    json.dump(
-        info,
-        open(
-            os.path.join(app.config['TEMP_DIR'], f'{id}_info.json'),
-            'w', encoding='utf-8'), ensure_ascii=False, indent=4)
-    try:
-        return send_from_directory(
-            app.config['TEMP_DIR'],
-            f'{id}_info.json',
-            as_attachment=True)
-    except Exception as error:
-        app.logger.error(
-            "Error downloading info : {}\n{}".format(
-                error, traceback.format_exc()))
+    '''
+    Streams the collection info, either as a single JSON object
+    (format=json, default) or as JSON Lines (format=jsonl), gzip
+    compressed if the client accepts it
+    '''
+    fmt = request.args.get('format', default='json')
+    if fmt not in ('json', 'jsonl'):
+        fmt = 'json'
+    chunks = stream_with_context(collection_info_stream(id, fmt=fmt))
+    headers = [
+        ('Content-Disposition',
+            f'attachment; filename="{id}_info.{fmt}"'),
+        ('Vary', 'Accept-Encoding')]
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_stream(chunks)
+        headers.append(('Content-Encoding', 'gzip'))
+    return Response(
+        chunks,
+        mimetype='application/x-ndjson' if fmt == 'jsonl'
+        else 'application/json',
+        headers=headers)
 
 
 @collection.route('/collections/<int:id>/edit/', methods=['GET', 'POST'])
@@ -7,16 +7,17 @@ import requests
 
 from datetime import date, datetime
 
-from flask import redirect, url_for, send_from_directory, request, render_template, flash, Blueprint
+from flask import redirect, url_for, request, render_template, flash, Blueprint
 from flask import current_app as app
 from flask_security import current_user, login_required, roles_accepted
 
-from lobe.db import get_verifiers, get_verifiers_and_admins, resolve_order
+from lobe.db import get_leaderboard, resolve_order
 from lobe.models import (PostAward, User, VerifierIcon, VerifierFont, VerifierTitle,
                          VerifierQuote, VerifierProgression, Recording, db,
                          SocialPost, PostAward)
 from lobe.forms import (DailySpinForm, VerifierIconForm, VerifierTitleForm,
                         VerifierQuoteForm, VerifierFontForm, PostLinkForm)
+from lobe.tools.http import send_cached_file
 
 feed = Blueprint(
     'feed', __name__,
@@ -33,9 +34,7 @@ def lobe_feed():
                 SocialPost,
                 request.args.get('sort_by', default='created_at'),
                 order=request.args.get('order', default='desc')))
-    verifiers = sorted(
-        get_verifiers_and_admins(),
-        key=lambda v: -v.progression.weekly_verifies)
+    verifiers = get_leaderboard(include_admins=True)
     return render_template(
         'lobe_feed.jinja',
         posts=posts,
@@ -184,9 +183,9 @@ def validate_youtube_link(link):
 @feed.route('/feed/send_banner/')
 def send_banner():
     try:
-        return send_from_directory(
+        return send_cached_file(
             app.config['STATIC_DATA_DIR'],
-            'banner.png')
+            'banner.png', private=False)
     except Exception as error:
         app.logger.error(
             "Error sending a beernight image : {}\n{}".format(
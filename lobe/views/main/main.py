@@ -1,11 +1,13 @@
 import os
 import traceback
 
-from flask import (redirect, url_for, render_template, send_from_directory,
+from flask import (redirect, url_for, render_template,
                    flash, request, Blueprint)
 from flask import current_app as app
 from flask_security import current_user, login_required
 
+from lobe.tools.http import send_cached_file
+
 main = Blueprint(
     'main', __name__,
     template_folder='templates',
@@ -33,7 +35,7 @@ def index_redirect():
 @login_required
 def download_manual():
     try:
-        return send_from_directory(
+        return send_cached_file(
             app.config['OTHER_DIR'], app.config['MANUAL_FNAME'],
             as_attachment=True)
     except Exception as error:
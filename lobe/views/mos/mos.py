@@ -6,7 +6,7 @@ import numpy as np
 from zipfile import ZipFile
 from operator import itemgetter
 
-from flask import (Blueprint, Response, send_from_directory, request,
+from flask import (Blueprint, Response, request,
                    render_template, flash, redirect, url_for)
 from flask import current_app as app
 from flask_security import login_required, roles_accepted, current_user
@@ -18,6 +18,7 @@ from lobe.db import (resolve_order, save_custom_wav, save_MOS_ratings,
                      delete_mos_instance_db)
 from lobe.forms import (MosSelectAllForm, MosUploadForm, MosItemSelectionForm,
                         MosTestForm, MosForm, MosDetailForm)
+from lobe.tools.http import send_cached_file
 
 mos = Blueprint(
     'mos', __name__, template_folder='templates')
@@ -428,7 +429,7 @@ def stream_MOS_zip(id):
 def stream_MOS_index_demo():
     other_dir = app.config["OTHER_DIR"]
     try:
-        return send_from_directory(
+        return send_cached_file(
             other_dir, 'synidaemi_mos.zip', as_attachment=True)
     except Exception as error:
         app.logger.error(
@@ -584,10 +585,10 @@ def mos_create_collection(id):
 def download_custom_recording(id):
     custom_recording = CustomRecording.query.get(id)
     try:
-        return send_from_directory(
+        return send_cached_file(
             custom_recording.get_directory(),
             custom_recording.fname,
-            as_attachment=True)
+            immutable=True, as_attachment=True)
     except Exception as error:
         flash("Error in finding recording.", category="warning")
         app.logger.error(
@@ -611,7 +612,7 @@ def custom_token(id):
 def download_custom_token(id):
     token = CustomToken.query.get(id)
     try:
-        return send_from_directory(
+        return send_cached_file(
             token.get_directory(),
             token.fname,
             as_attachment=True)
@@ -2,16 +2,19 @@ from functools import wraps
 import traceback
 import json
 import os
+import threading
 
 from flask import (Blueprint, redirect, url_for, request, render_template,
-                   flash, Response, send_from_directory, jsonify)
+                   flash, Response, jsonify, abort)
 from flask import current_app as app
 from flask_security import current_user, login_required, roles_accepted
 
 from lobe.models import Collection, Recording, User, Token, db, Session, PrioritySession
-from lobe.tools.analyze import (find_segment, load_sample, signal_is_too_high,
-                                signal_is_too_low)
+from lobe.tools.analyze import analyze_sample, load_sample_from_bytes
 from lobe.db import resolve_order, delete_recording_db, save_recording_session
+from lobe.tools.http import send_cached_file
+from lobe.managers import (create_recording_peaks, create_recording_preview,
+                           create_recording_file, process_session_audio)
 
 recording = Blueprint(
     'recording', __name__,
@@ -26,20 +29,26 @@ recording = Blueprint(
 def recording_list():
     page = int(request.args.get('page', 1))
     only_bad = bool(request.args.get('only_bad', False))
+    analysis = request.args.get('analysis')
+    min_snr = request.args.get('min_snr', type=float)
+    max_clipping = request.args.get('max_clipping', type=float)
 
+    recordings = Recording.query
     if only_bad:
-        recordings = db.session.query(Recording)\
-            .filter_by(marked_as_bad=True)\
-            .paginate(
-                page,
-                per_page=app.config['RECORDING_PAGINATION'])
-    else:
-        recordings = Recording.query.order_by(
-            resolve_order(
-                Recording,
-                request.args.get('sort_by', default='created_at'),
-                order=request.args.get('order', default='desc')))\
-            .paginate(page, per_page=app.config['RECORDING_PAGINATION'])
+        recordings = recordings.filter_by(marked_as_bad=True)
+    if analysis:
+        recordings = recordings.filter(Recording.analysis == analysis)
+    if min_snr is not None:
+        recordings = recordings.filter(Recording.snr_db >= min_snr)
+    if max_clipping is not None:
+        recordings = recordings.filter(
+            Recording.clipping_ratio <= max_clipping)
+    recordings = recordings.order_by(
+        resolve_order(
+            Recording,
+            request.args.get('sort_by', default='created_at'),
+            order=request.args.get('order', default='desc')))\
+        .paginate(page, per_page=app.config['RECORDING_PAGINATION'])
 
     return render_template(
         'recording_list.jinja',
@@ -101,15 +110,91 @@ def toggle_recording_bad_ajax(id):
 def download_recording(id):
     recording = Recording.query.get(id)
     try:
-        return send_from_directory(
+        return send_cached_file(
             recording.get_directory(), recording.fname,
-            as_attachment=True)
+            immutable=True, as_attachment=True)
     except Exception as error:
         app.logger.error(
             "Error downloading a recording : {}\n{}".format(
                 error, traceback.format_exc()))
 
 
+# Keys of the recording files queued on the executor, see
+# queue_recording_file
+queued_recording_files = set()
+queued_recording_files_lock = threading.Lock()
+
+
+def queue_recording_file(create, id):
+    '''
+    Creates a missing file of the recording, e.g. its peaks, on the
+    executor instead of in the request. Does nothing if the same file
+    is already queued, since the verification UI requests several
+    recordings at once. The key is reserved before the job is
+    submitted so concurrent requests never submit it twice.
+    '''
+    key = (create.__name__, id)
+    with queued_recording_files_lock:
+        if key in queued_recording_files:
+            return
+        queued_recording_files.add(key)
+
+    def done(_):
+        with queued_recording_files_lock:
+            queued_recording_files.discard(key)
+
+    try:
+        future = app.executor.submit(create_recording_file, create, id)
+    except Exception:
+        done(None)
+        raise
+    future.add_done_callback(done)
+
+
+@recording.route('/recordings/<int:id>/peaks/')
+@login_required
+def recording_peaks(id):
+    '''
+    Serves the precomputed waveform peaks of the recording, see
+    lobe.tools.waveform for the layout. Peaks are created on ingest
+    or with manage.py update_waveform_peaks. Missing peaks are queued
+    on the executor and 404 is returned, the client then draws the
+    waveform from the audio itself.
+    '''
+    recording = Recording.query.get(id)
+    if recording is None:
+        abort(404)
+    peaks_path = recording.get_peaks_path()
+    if not os.path.exists(peaks_path):
+        queue_recording_file(create_recording_peaks, id)
+        return Response("Bylgjuform ekki tilbúið", status=404)
+    return send_cached_file(
+        os.path.dirname(peaks_path), os.path.basename(peaks_path),
+        immutable=True, mimetype='application/octet-stream')
+
+
+@recording.route('/recordings/<int:id>/preview/')
+@login_required
+def recording_preview(id):
+    '''
+    Serves the low bitrate Opus preview of the recording, which is what
+    verifiers listen to, see lobe.managers.create_recording_preview.
+    Previews are created on ingest or with manage.py
+    update_recording_previews. Missing previews are queued on the
+    executor and the original recording is served in the meantime.
+    '''
+    recording = Recording.query.get(id)
+    if recording is None:
+        abort(404)
+    preview_path = recording.get_preview_path()
+    if not os.path.exists(preview_path):
+        queue_recording_file(create_recording_preview, id)
+        return redirect(url_for('recording.download_recording', id=id))
+    return send_cached_file(
+        os.path.dirname(preview_path), os.path.basename(preview_path),
+        immutable=True, mimetype='audio/webm')
+
+
 def require_login_if_closed_collection(func):
     """
     If collection is part of a posting we need to allow applicants to access
@@ -210,33 +295,24 @@ def record_session(collection_id):
 @login_required
 @roles_accepted('admin', 'Notandi')
 def analyze_audio():
-    # save to disk, only one file in the form
+    max_size = app.config['ANALYZE_MAX_CONTENT_LENGTH']
+    if request.content_length is not None and \
+            request.content_length > max_size:
+        return Response("Hljóðskráin er of stór", status=413)
+
+    # only one file in the form, decoded in memory
     file_obj = next(iter(request.files.values()))
-    file_path = os.path.join(app.config['TEMP_DIR'], file_obj.filename)
-    file_obj.save(file_path)
-
-    high_thresh = float(request.form['high_thresh'])
-    high_frames = int(request.form['high_frames'])
-    low_thresh = float(request.form['low_thresh'])
-    top_db = float(request.form['top_db'])
-
-    # load the sample
-    sample, sr = load_sample(file_path)
-    segment_times = find_segment(sample, sr, top_db=top_db)
-    # check the sample and return the response
-    message = 'ok'
-    if signal_is_too_high(sample, thresh=high_thresh, num_frames=high_frames):
-        message = 'high'
-    elif signal_is_too_low(sample, thresh=low_thresh):
-        message = 'low'
-
-    body = {
-        'analysis': message,
-        'segment': {
-            'start': float(segment_times[0]),
-            'end': float(segment_times[1])
-        }
-    }
+    data = file_obj.stream.read(max_size + 1)
+    if len(data) > max_size:
+        return Response("Hljóðskráin er of stór", status=413)
+
+    sample, sr = load_sample_from_bytes(data)
+    body = analyze_sample(
+        sample, sr,
+        high_thresh=float(request.form['high_thresh']),
+        high_frames=int(request.form['high_frames']),
+        low_thresh=float(request.form['low_thresh']),
+        top_db=float(request.form['top_db']))
     return jsonify(body), 200
 
 
@@ -286,6 +362,9 @@ def post_recording():
             error, traceback.format_exc()))
         return Response(str(error), status=500)
 
+    if session_id is not None:
+        app.executor.submit(process_session_audio, session_id)
+
     if collection.posting:
         return Response(url_for("application.application_success"))
     elif session_id is None:
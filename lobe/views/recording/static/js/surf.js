@@ -128,7 +128,7 @@ function createMicSurfer(context, container){
 }
 
 // wavesurfer specifically for the /recordings/<id> route
-function createRecordWaveSurfer(container, has_video, playButtonIcon){
+function createRecordWaveSurfer(container, has_video, playButtonIcon, media_element=false){
     let options = {
         container:container,
         plugins: [
@@ -136,7 +136,7 @@ function createRecordWaveSurfer(container, has_video, playButtonIcon){
                 dragSelection: {slop: 5},
                 color: "rgba(243, 156, 18, 0.1)"
             })]}
-    if(has_video){
+    if(has_video || media_element){
         options = {...options, ...{backend: 'MediaElement'}};
     }
 
@@ -173,4 +173,60 @@ function createRecordWaveSurfer(container, has_video, playButtonIcon){
 
     return wavesurfer;
 
-}
\ No newline at end of file
+}
+
+// Parses a peaks file as written by lobe/tools/waveform.py and returns the
+// peaks of the coarsest zoom level that still has at least `width` buckets,
+// as [max, min, max, min, ...] which is what wavesurfer expects.
+function parsePeaks(buffer, width){
+    const view = new DataView(buffer);
+    const sampleRate = view.getUint32(4, true);
+    const numSamples = view.getUint32(8, true);
+    const numLevels = view.getUint16(14, true);
+
+    let offset = 16 + 6 * numLevels;
+    let levels = [];
+    for(let i=0; i<numLevels; i++){
+        const numBuckets = view.getUint32(16 + 6 * i + 2, true);
+        levels.push({offset: offset, numBuckets: numBuckets});
+        offset += 2 * numBuckets;
+    }
+    let level = levels[0];
+    for(let i=1; i<levels.length; i++){
+        if(levels[i].numBuckets >= width){
+            level = levels[i];
+        }
+    }
+
+    const pairs = new Int8Array(buffer, level.offset, 2 * level.numBuckets);
+    let peaks = new Array(pairs.length);
+    for(let i=0; i<level.numBuckets; i++){
+        peaks[2 * i] = pairs[2 * i + 1] / 127;
+        peaks[2 * i + 1] = pairs[2 * i] / 127;
+    }
+    return {peaks: peaks, duration: numSamples / sampleRate};
+}
+
+// Draws the waveform from the precomputed peaks right away and lets the
+// media element fetch the audio itself. Falls back to a regular load.
+function loadWithPeaks(wavesurfer, audioUrl, peaksUrl){
+    fetch(peaksUrl, {credentials: 'same-origin'})
+        .then(function(response){
+            if(!response.ok){
+                throw new Error(response.statusText);
+            }
+            return response.arrayBuffer();
+        })
+        .then(function(buffer){
+            if(wavesurfer.isDestroyed){
+                return;
+            }
+            const waveform = parsePeaks(buffer, wavesurfer.drawer.getWidth());
+            wavesurfer.load(audioUrl, waveform.peaks, 'auto', waveform.duration);
+        })
+        .catch(function(){
+            if(!wavesurfer.isDestroyed){
+                wavesurfer.load(audioUrl);
+            }
+        });
+}
@@ -1,12 +1,13 @@
 import traceback
 
 from flask import (redirect, url_for, render_template, request,
-                   send_from_directory, flash, Blueprint)
+                   flash, Blueprint)
 from flask import current_app as app
 from flask_security import login_required, roles_accepted
 
 from lobe.models import Token, db
 from lobe.db import resolve_order, delete_token_db
+from lobe.tools.http import send_cached_file
 
 token = Blueprint(
     'token', __name__, template_folder='templates')
@@ -45,7 +46,7 @@ def token_list():
 def download_token(id):
     token = Token.query.get(id)
     try:
-        return send_from_directory(
+        return send_cached_file(
             token.get_directory(),
             token.fname,
             as_attachment=True)
@@ -1,5 +1,4 @@
 import json
-import random
 import re
 import datetime
 from datetime import datetime, timedelta
@@ -8,15 +7,19 @@ import traceback
 from datetime import date, datetime
 
 from flask import (render_template, flash, request, redirect, url_for,
-                   Response, Blueprint)
+                   Response, Blueprint, stream_with_context, abort)
 from flask import current_app as app
 from flask_security import current_user, login_required, roles_accepted
+from werkzeug.datastructures import MultiDict
 
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import noload, selectinload
 
-from lobe.db import get_verifiers, activity, insert_trims, resolve_order
+from lobe.db import (activity, resolve_order, schedule_session,
+                     save_verification, get_leaderboard,
+                     invalidate_leaderboard, get_verification_stats)
 from lobe.forms import DailySpinForm, SessionVerifyForm, DeleteVerificationForm
-from lobe.models import PrioritySession, Verification, Session, User, Recording, db, Collection
+from lobe.models import (PrioritySession, Verification, Session, User,
+                         Recording, db, Token, Trim)
 
 verification = Blueprint(
     'verification', __name__, template_folder='templates')
@@ -26,180 +29,123 @@ verification = Blueprint(
 @login_required
 def verify_queue():
     '''
-    Finds the oldest and unverified session and redirects
-    to that session verification. The session must either
-    be assigned to the current user id or no user id
+    Claims the session the current user should verify next and
+    redirects to that session verification. Sessions the user has
+    already claimed are resumed first, then priority sessions, sessions
+    with priority and the oldest sessions are claimed, first for
+    verification and then secondary verification. See
+    lobe.db.schedule_session.
     '''
-
-    '''
-    First checks if there are any priority sessions,
-    then it uses the following list to priorities 
-    those available. 
-
-    Logic of queue priority:
-    1. Check if there are sessions that are not verified
-    2. Check if any are not assigned to other users
-    3. Check if any are not secondarily verified
-    4. Check if any of those are not assigned to other users
-    '''
-
-    chosen_session = None
-    is_secondary = False
-    priority_session = None
-    normal_session = True
-    #priority_session, is_secondary, normal_session = check_priority_session()
-    if priority_session:
-        chosen_session = priority_session
-    else:
-        # Has the user already started a session?
-        unverified_sessions = Session.query.join(Session.collection).filter(
-            Session.is_verified == False,
-            Collection.is_dev == False,
-            Collection.verify == True)
-        if unverified_sessions.count() > 0:
-            available_sessions = unverified_sessions.filter(
-                or_(
-                    Session.verified_by == None,
-                    Session.verified_by == current_user.id))\
-                .order_by(
-                    Session.verified_by)
-
-            if available_sessions.count() > 0:
-                # We have available sessions
-                if available_sessions[0].verified_by == current_user.id:                    
-                    chosen_session = available_sessions[0]
-                else:
-                    random_session_index = random.randrange(available_sessions.count())
-                    chosen_session = available_sessions[random_session_index]
-                    chosen_session.verified_by = current_user.id
-
-        if chosen_session is None:
-            # check if we can secondarily verify any sesssions
-            secondarily_unverified_sessions = Session.query.join(Session.collection).filter(
-                and_(
-                    Session.is_secondarily_verified == False,
-                    Session.verified_by != current_user.id
-                ),
-                Collection.is_dev == False,
-                Collection.verify == True)
-
-            if secondarily_unverified_sessions.count() > 0:
-                available_sessions = secondarily_unverified_sessions.filter(
-                    or_(
-                        Session.secondarily_verified_by == None,
-                        Session.secondarily_verified_by == current_user.id
-                    )).order_by(Session.secondarily_verified_by)
-
-                if available_sessions.count() > 0:
-                    # we have an available session
-                    is_secondary = True
-                    if available_sessions[0].secondarily_verified_by == current_user.id:
-                        chosen_session = available_sessions[0]
-                    else:
-                        random_session_index = random.randrange(available_sessions.count())
-                        chosen_session = available_sessions[random_session_index]
-                        chosen_session.secondarily_verified_by = current_user.id
-
+    chosen_session, is_secondary, is_priority = schedule_session(
+        current_user.id)
     if chosen_session is None:
         # there are no sessions left to verify
         flash("Engar lotur eftir til að greina", category="warning")
         return redirect(url_for("verification.verify_index"))
 
-    # Once queued, a session is assigned to a user id to avoid
-    # double queueing
-    db.session.commit()
-    url = url_for('verification.verify_session', id=chosen_session.id)
+    return redirect(verify_session_url(
+        chosen_session.id, is_secondary, is_priority))
+
+
+def verify_session_url(id, is_secondary=False, is_priority=False):
+    url_args = {}
+    if is_secondary:
+        url_args['is_secondary'] = True
+    if is_priority:
+        url_args['is_priority'] = True
+    return url_for('verification.verify_session', id=id, **url_args)
+
+
+URL_ID_PLACEHOLDER = 987654321
+
+
+def url_template(endpoint):
+    '''
+    Returns the url of an endpoint taking an id, with {} in place of
+    the id, so urls can be formatted for many objects without building
+    each one with url_for
+    '''
+    return url_for(endpoint, id=URL_ID_PLACEHOLDER).replace(
+        str(URL_ID_PLACEHOLDER), '{}')
+
+
+def verify_session_payload(id, is_secondary=False, is_priority=False):
+    '''
+    Returns the session the verify_session page is built from as a
+    dictionary, with the recordings that are left to (secondarily)
+    verify, or None if the session does not exist. The recordings
+    and their tokens come from one query and their verifications and
+    trims are loaded in bulk.
+    '''
+    model = PrioritySession if is_priority else Session
+    session = model.query.options(noload(model.recordings)).get(id)
+    if session is None:
+        return None
+    if is_priority:
+        recordings = Recording.query.filter(
+            Recording.priority_session_id == id)
+    else:
+        recordings = Recording.query.filter(Recording.session_id == id)
+    # make sure we only verify recordings that haven't been verified
+    # two times
     if is_secondary:
-        url = url + '?is_secondary={}'.format(is_secondary)
-    if priority_session and not normal_session:
-        url = url + '?is_priority={}'.format(True)
-    return redirect(url)
-
-
-def check_priority_session():
-    unverified_sessions = PrioritySession.query.filter(and_(
-        PrioritySession.is_verified == False, PrioritySession.is_dev == False))
-    chosen_session = None
-    is_secondary = False
-    normal_session = False
-    if unverified_sessions.count() > 0:
-        available_sessions = unverified_sessions.filter(
-            or_(
-                PrioritySession.verified_by == None,
-                PrioritySession.verified_by == current_user.id))\
-            .order_by(
-                PrioritySession.verified_by)
-
-        if available_sessions.count() > 0:
-            # we have an available session
-            chosen_session = available_sessions[0]
-            chosen_session.verified_by = current_user.id
-
-    if not chosen_session:
-        unverified_sessions = Session.query.filter(and_(
-                Session.is_verified == False, Session.is_dev == False,
-                Session.has_priority == True))
-        if unverified_sessions.count() > 0:
-            available_sessions = unverified_sessions.filter(
-                or_(
-                    Session.verified_by == None,
-                    Session.verified_by == current_user.id))\
-                .order_by(
-                    Session.verified_by)
-            if available_sessions.count() > 0:
-                # we have an available session
-                chosen_session = available_sessions[0]
-                chosen_session.verified_by = current_user.id
-                normal_session = True
-    db.session.commit()
-
-    return chosen_session, is_secondary, normal_session
+        recordings = recordings.filter(
+            Recording.is_secondarily_verified.isnot(True))
+    else:
+        recordings = recordings.filter(Recording.is_verified.isnot(True))
+    recordings = recordings\
+        .join(Token, Recording.token_id == Token.id)\
+        .with_entities(Recording, Token.text, Token.fname)\
+        .options(selectinload(Recording.verifications)
+                 .selectinload(Verification.trims))\
+        .order_by(Recording.id)
+
+    rec_url = url_template('recording.download_recording')
+    rec_peaks_url = url_template('recording.recording_peaks')
+    rec_preview_url = url_template('recording.recording_preview')
+    text_url = url_template('token.token_detail')
+    session_dict = {
+        'id': session.id,
+        'printable_id': session.get_printable_id(),
+        'collection_id': session.collection_id,
+        'is_secondary': is_secondary,
+        'is_priority': is_priority,
+        'url': verify_session_url(session.id, is_secondary, is_priority),
+        'recordings': [],
+    }
+    for recording, text, text_fname in recordings:
+        session_dict['recordings'].append({
+            'rec_id': recording.id,
+            'rec_fname': recording.fname,
+            'rec_url': rec_url.format(recording.id),
+            'rec_peaks_url': rec_peaks_url.format(recording.id),
+            'rec_preview_url': rec_preview_url.format(recording.id),
+            'rec_num_verifies': len(recording.verifications),
+            'text': text,
+            'text_file_id': text_fname,
+            'text_url': text_url.format(recording.token_id),
+            'token_id': recording.token_id})
+
+        if recording.is_verified and recording.verifications:
+            # add the verification object
+            session_dict['recordings'][-1]['verification'] =\
+                recording.verifications[0].dict
+    return session_dict
+
 
 @verification.route('/sessions/<int:id>/verify/')
 @login_required
 def verify_session(id):
     is_secondary = bool(request.args.get('is_secondary', False))
     is_priority = bool(request.args.get('is_priority', False))
-    form = SessionVerifyForm()
-    if is_priority:
-        session = PrioritySession.query.get(id)
-        session_dict = {
-            'id': session.id,
-            'is_secondary': is_secondary,
-            'recordings': [],
-        }
-    else:
-        session = Session.query.get(id)
-        session_dict = {
-            'id': session.id,
-            'collection_id': session.collection.id,
-            'is_secondary': is_secondary,
-            'recordings': [],
-        }
-    for recording in session.recordings:
-        # make sure we only verify recordings that haven't been verified
-        # two times
-        if (not recording.is_verified and not is_secondary) \
-                or (not recording.is_secondarily_verified and is_secondary):
-            session_dict['recordings'].append({
-                'rec_id': recording.id,
-                'rec_fname': recording.fname,
-                'rec_url': recording.get_download_url(),
-                'rec_num_verifies': len(recording.verifications),
-                'text': recording.token.text,
-                'text_file_id': recording.token.fname,
-                'text_url': recording.token.get_url(),
-                'token_id': recording.token.id})
-
-            if recording.is_verified:
-                # add the verification object
-                session_dict['recordings'][-1]['verification'] =\
-                    recording.verifications[0].dict
+    session_dict = verify_session_payload(id, is_secondary, is_priority)
+    if session_dict is None:
+        abort(404)
 
     return render_template(
         'verify_session.jinja',
-        session=session,
-        form=form,
+        session=session_dict,
+        form=SessionVerifyForm(),
         isPriority=is_priority,
         delete_form=DeleteVerificationForm(),
         json_session=json.dumps(session_dict),
@@ -208,6 +154,33 @@ def verify_session(id):
         progression_view=True)
 
 
+@verification.route('/verification/next_session/')
+@login_required
+def next_session():
+    '''
+    Claims the session the current user verifies after the one given
+    with ?current=<id>, and &is_priority=True if it is a priority
+    session, in the same order as verify_queue and returns it as JSON
+    so the client can buffer it and switch to it right away. Returns an
+    empty object if there are no sessions left to verify.
+    '''
+    current = request.args.get('current', type=int)
+    exclude = {}
+    if current is not None:
+        current_model = PrioritySession if \
+            bool(request.args.get('is_priority', False)) else Session
+        exclude[current_model] = [current]
+    chosen_session, is_secondary, is_priority = schedule_session(
+        current_user.id, exclude=exclude)
+
+    session_dict = {}
+    if chosen_session is not None:
+        session_dict = verify_session_payload(
+            chosen_session.id, is_secondary, is_priority)
+    return Response(
+        json.dumps(session_dict), status=200, mimetype='application/json')
+
+
 @verification.route('/verifications', methods=['GET'])
 @login_required
 def verification_list():
@@ -225,16 +198,86 @@ def verification_list():
         section='verification')
 
 
+VERIFICATION_TSV_HEADER = [
+    'recording_id', 'volume_is_low', 'volume_is_high',
+    'recording_has_glitch', 'recording_has_wrong_wording', 'comment',
+    'verification_id', 'verified_by', 'created_at', 'is_secondary', 'trims']
+
+
 @verification.route('/verifications/all/', methods=['GET'])
 @login_required
 def download_verifications():
-    verifications = Verification.query.all()
-    response_lines = [
-        verification.as_tsv_line() for verification in verifications
-    ]
-    r = Response(response="\n".join(response_lines), status=200, mimetype="text/plain")
-    r.headers["Content-Type"] = "text/plain; charset=utf-8"
-    return r
+    '''
+    Streams all verifications as TSV with a header row. The first six
+    columns are the same as Verification.as_tsv_line. Trims are listed
+    as start-end pairs separated by ';'. Can be filtered with:
+    * start_date, end_date (YYYY-MM-DD): created in this range, end
+    date inclusive
+    * collection_id: verifications of recordings in this collection
+    * verified_by: verifications made by this user
+    '''
+    query = db.session.query(
+        Verification.recording_id, Verification.volume_is_low,
+        Verification.volume_is_high, Verification.recording_has_glitch,
+        Verification.recording_has_wrong_wording, Verification.comment,
+        Verification.id, Verification.verified_by, Verification.created_at,
+        Verification.is_secondary, Trim.start, Trim.end)\
+        .outerjoin(Trim, Trim.verification_id == Verification.id)\
+        .order_by(Verification.id, Trim.index, Trim.id)
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    collection_id = request.args.get('collection_id', type=int)
+    verified_by = request.args.get('verified_by', type=int)
+    if start_date:
+        query = query.filter(Verification.created_at >= datetime.strptime(
+            start_date, '%Y-%m-%d'))
+    if end_date:
+        query = query.filter(Verification.created_at < datetime.strptime(
+            end_date, '%Y-%m-%d') + timedelta(days=1))
+    if collection_id is not None:
+        query = query\
+            .join(Recording, Verification.recording_id == Recording.id)\
+            .join(Token, Recording.token_id == Token.id)\
+            .filter(Token.collection_id == collection_id)
+    if verified_by is not None:
+        query = query.filter(Verification.verified_by == verified_by)
+
+    def as_tsv_line(row, trims):
+        *flags, comment, id, verified_by, created_at, is_secondary = row
+        return "\t".join(map(str, [
+            *[int(flag) if flag is not None else '' for flag in flags[:5]],
+            (comment or "").replace("\n", "\\n").replace("\t", "\\t"),
+            id,
+            verified_by if verified_by is not None else '',
+            created_at.isoformat() if created_at is not None else '',
+            int(bool(is_secondary)),
+            ";".join(f"{start}-{end}" for start, end in trims)])) + "\n"
+
+    def generate():
+        yield "\t".join(VERIFICATION_TSV_HEADER) + "\n"
+        # a verification spans one row per trim, consecutive since the
+        # rows are ordered by verification
+        current, trims, lines = None, [], []
+        for row in query.yield_per(5000):
+            if current is not None and row[6] != current[6]:
+                lines.append(as_tsv_line(current, trims))
+                trims = []
+            current = row[:10]
+            if row[10] is not None:
+                trims.append((row[10], row[11]))
+            if len(lines) >= 1000:
+                yield "".join(lines)
+                lines = []
+        if current is not None:
+            lines.append(as_tsv_line(current, trims))
+        yield "".join(lines)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/plain",
+        headers=[
+            ('Content-Disposition',
+                'attachment; filename="verifications.tsv"')])
 
 
 @verification.route('/verifications/<int:id>/')
@@ -256,87 +299,12 @@ def create_verification():
     form = SessionVerifyForm(request.form)
     try:
         if form.validate():
-            is_priority = form.data['isPriority'] == "True"
-            is_secondary = int(form.data['num_verifies']) > 0
-            verification = Verification()
-            verification.set_quality(form.data['quality'])
-            verification.comment = form.data['comment']
-            verification.recording_id = int(form.data['recording'])
-            verification.is_secondary = is_secondary
-            verification.verified_by = int(form.data['verified_by'])
-            db.session.add(verification)
-            db.session.flush()
-            verification_id = verification.id
-            db.session.commit()
-            recording = Recording.query.get(int(form.data['recording']))
-            if is_secondary:
-                recording.is_secondarily_verified = True
-                recording.is_verified = True  # Sometimes this is missing for some reason
-            else:
-                recording.is_verified = True
-            db.session.commit()
-
-            insert_trims(form.data['cut'], verification_id)
-            progression = User.query.get(form.data['verified_by']).progression
-
-            # check if this was the final recording to be verified and update
-            if is_priority:
-                session = PrioritySession.query.get(int(form.data['session']))
-            else:
-                session = Session.query.get(int(form.data['session']))
-            recordings = Recording.query.filter(
-                Recording.session_id == session.id)
-            num_recordings = recordings.count()
-            achievements = []
-            if is_secondary and num_recordings == recordings.filter(
-                    Recording.is_secondarily_verified == True).count():
-                session.is_secondarily_verified = True
-                db.session.commit()
-            if num_recordings == recordings.filter(
-                    Recording.is_verified == True).count():
-                session.is_verified = True
-                progression.num_session_verifies += 1
-                progression.lobe_coins += \
-                    app.config['ECONOMY']['session']['coin_reward']
-                progression.experience += \
-                    app.config['ECONOMY']['session']['experience_reward']
-                db.session.commit()
-
-            # update progression on user
-            progression.lobe_coins += \
-                app.config['ECONOMY']['verification']['coin_reward']
-            progression.experience += \
-                app.config['ECONOMY']['verification']['experience_reward']
-            progression.num_verifies += 1
-            progression.weekly_verifies += 1
-            if not verification.recording_is_good:
-                progression.num_invalid += 1
-
-            # check for achivement updates:
-            # 1. verification:
-            verification_levels = app.config['ECONOMY']['achievements'][
-                'verification'].keys()
-            if progression.verification_level in verification_levels:
-                verification_info = app.config['ECONOMY']['achievements'][
-                    'verification'][str(progression.verification_level)]
-                if progression.num_verifies >= verification_info['goal']:
-                    progression.verification_level += 1
-                    progression.lobe_coins += verification_info['coin_reward']
-                    progression.experience += \
-                        verification_info['experience_reward']
-                    achievements.append('verification')
-            else:
-                pass
-            # 2. bad verifications
-            spy_info = app.config['ECONOMY']['achievements']['spy'][
-                str(progression.spy_level)]
-            if progression.num_invalid >= spy_info['goal']:
-                progression.spy_level += 1
-                progression.lobe_coins += spy_info['coin_reward']
-                progression.experience += spy_info['experience_reward']
-                achievements.append('spy')
-
+            progression = User.query.get(
+                int(form.data['verified_by'])).progression
+            verification_id, achievements = save_verification(
+                form, progression)
             db.session.commit()
+            invalidate_leaderboard()
 
             response = {
                 'id': verification_id,
@@ -350,8 +318,79 @@ def create_verification():
                 key, ", ".join(value)) for key, value in form.errors.items()))
             return Response(errorMessage, status=500)
     except Exception as error:
+        db.session.rollback()
         app.logger.error('Error creating a verification : {}\n{}'.format(
             error, traceback.format_exc()))
+        return Response(str(error), status=500)
+
+
+@verification.route('/verifications/create_batch/', methods=['POST'])
+@login_required
+def create_verifications():
+    '''
+    Creates all the verifications of a session posted as one JSON
+    object, e.g.:
+    {"session": 1, "isPriority": "False", "verified_by": 2,
+     "verifications": [{"recording": 3, "num_verifies": 0,
+                        "quality": ["ok"], "comment": "",
+                        "cut": [{"start": 0.1, "end": 1.2}]}, ...]}
+    Either all of them are written, in one transaction, or none.
+    '''
+    data = request.get_json(silent=True)
+    if not data or not data.get('verifications'):
+        return Response("Engar greiningar bárust", status=400)
+    forms, errors = [], []
+    for idx, item in enumerate(data['verifications']):
+        fields = [
+            ('recording', item.get('recording')),
+            ('verified_by', data.get('verified_by')),
+            ('session', data.get('session')),
+            ('num_verifies', item.get('num_verifies')),
+            ('cut', json.dumps(item.get('cut', []))),
+            ('isPriority', data.get('isPriority')),
+            ('comment', item.get('comment') or '')]
+        fields += [('quality', quality) for quality in item.get('quality', [])]
+        # the form expects the strings a browser would post
+        formdata = MultiDict(
+            (key, str(value)) for key, value in fields if value is not None)
+        form = SessionVerifyForm(formdata)
+        if form.validate():
+            forms.append(form)
+        else:
+            errors.extend("{} - {}: {}".format(
+                item.get('recording'), key, ", ".join(value))
+                for key, value in form.errors.items())
+    if errors:
+        return Response("<br>".join(errors), status=400)
+
+    try:
+        progression = User.query.get(int(data['verified_by'])).progression
+        verifications, achievements = [], []
+        for form in forms:
+            verification_id, item_achievements = save_verification(
+                form, progression)
+            achievements.extend(item_achievements)
+            verifications.append({
+                'id': verification_id,
+                'recording': int(form.data['recording']),
+                'coins': progression.lobe_coins,
+                'experience': progression.experience,
+                'achievements': item_achievements})
+        db.session.commit()
+        invalidate_leaderboard()
+
+        response = {
+            'verifications': verifications,
+            'coins': progression.lobe_coins,
+            'experience': progression.experience,
+            'achievements': achievements}
+
+        return Response(json.dumps(response), status=200)
+    except Exception as error:
+        db.session.rollback()
+        app.logger.error('Error creating verifications : {}\n{}'.format(
+            error, traceback.format_exc()))
+        return Response(str(error), status=500)
 
 
 @verification.route('/verifications/delete', methods=['POST'])
@@ -411,7 +450,10 @@ def delete_verification():
             'ECONOMY']['verification']['experience_reward'])
 
         db.session.delete(verification)
+        db.session.flush()
+        session.update_numbers()
         db.session.commit()
+        invalidate_leaderboard()
 
         response = {
             'coins': progression.lobe_coins,
@@ -430,9 +472,7 @@ def verify_index():
     '''
     Home screen of the verifiers
     '''
-    verifiers = sorted(
-        get_verifiers(),
-        key=lambda v: -v.progression.weekly_verifies)
+    verifiers = get_leaderboard()
     weekly_verifies = sum([v.progression.weekly_verifies for v in verifiers])
     if weekly_verifies < app.config['ECONOMY']['weekly_challenge']['goal']:
         weekly_progress = 100 *\
@@ -507,38 +547,14 @@ def verify_stats():
     '''
     Statistics screen of the verifiers
     '''
-    verifiers = sorted(
-        get_verifiers(),
-        key=lambda v: -v.progression.weekly_verifies)
-    
-    verifications = Verification.query
-    verifications_all = verifications.all()
-    verify_stats = {
-        "total_count": len(verifications_all),
-        "double_verified": verifications.filter(Verification.is_secondary == True).count(),
-        "single_verified": verifications.filter(Verification.is_secondary == False).count(),
-        "count_past_week": verifications.filter(Verification.created_at >= datetime.now() - timedelta(days=7)).count(),
-        "count_good": verifications.filter(and_(
-            Verification.volume_is_low == False,
-            Verification.volume_is_high == False,
-            Verification.recording_has_wrong_wording == False,
-            Verification.recording_has_glitch == False)).count(),
-        "count_bad": verifications.filter(or_(
-            Verification.volume_is_low == True,
-            Verification.volume_is_high == True,
-            Verification.recording_has_wrong_wording == True,
-            Verification.recording_has_glitch == True)).count(),
-    }
+    verifiers = get_leaderboard()
+
     from_arg = request.args.get('from')
     to_arg = request.args.get('to')
     if valid_dates([from_arg, to_arg]):
-        custon_dates = Verification.query.filter(db.func.date(Verification.created_at).between(from_arg, to_arg))
-        date_selection = {
-            'from': from_arg,
-            'to': to_arg,
-            'number': custon_dates.count()
-        }
-        verify_stats['date_selection'] = date_selection
+        verify_stats = get_verification_stats(from_arg, to_arg)
+    else:
+        verify_stats = get_verification_stats()
 
     activity_days, activity_counts = activity(Verification)
 
@@ -4,29 +4,43 @@ import re
 import sys
 import json
 import uuid
+import time
 import traceback
 import datetime
-from shutil import copyfile
+import wave
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 from tqdm import tqdm
 from random import randrange
 
+from flask import url_for
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Command, Manager
 from flask_security.utils import hash_password
-from sqlalchemy import and_
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import noload
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from termcolor import colored
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from lobe import app
 from lobe.models import (Recording, Token, User, Role, Collection,
-                         Configuration, Session, VerifierProgression,
+                         Configuration, Session, PrioritySession,
+                         VerifierProgression,
                          VerifierIcon, VerifierQuote, VerifierTitle, db,
-                         MosInstance)
-from lobe.db import get_verifiers, get_admins, get_verifiers_and_admins
-from lobe.tools.analyze import (load_sample, signal_is_too_high,
-                                signal_is_too_low)
+                         MosInstance, Verification)
+from lobe.db import (get_verifiers, get_admins, get_verifiers_and_admins,
+                     expired_session_claims, session_claim_columns,
+                     verifiers_filter, refresh_activity_rollup)
+from lobe.managers import (create_recording_peaks, create_recording_preview,
+                           create_collection_shards,
+                           create_collection_metadata, collection_export_rows,
+                           collection_meta)
+from lobe.tools.data_tools import (link_or_copy, ds_to_merlinformat,
+                                   write_merlinformat)
+from lobe.tools.analyze import (load_sample, load_sample_from_bytes,
+                                analyze_sample, analyze_file)
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -224,7 +238,7 @@ class changeDataRoot(Command):
 
 
 @manager.command
-def download_collection(collection_id, out_dir):
+def download_collection(collection_id, out_dir, resume=False, num_workers=16):
     '''
     Will create:
     * out_dir/audio/...
@@ -232,71 +246,83 @@ def download_collection(collection_id, out_dir):
     * out_dir/index.tsv
     * out_dir/info.json
     * out_dir/meta.json
+
+    Files are reflinked or hardlinked when possible and copied by a
+    pool of num_workers threads otherwise. With --resume, files that
+    are already in out_dir with the right size are skipped.
     '''
     collection = Collection.query.get(collection_id)
-    tokens = collection.tokens
-    dl_tokens = []
-    for token in tokens:
-        if token.num_recordings > 0:
-            dl_tokens.append(token)
-    if not os.path.exists(out_dir):
-        os.makedirs(os.path.join(out_dir, 'audio'))
-        os.makedirs(os.path.join(out_dir, 'text'))
-    index_f = open(os.path.join(out_dir, 'index.tsv'), 'w')
-
+    user_names = {
+        user.id: user.name for user in User.query.filter(
+            User.id.in_(collection.user_ids))}
+
+    files = []
+    directories = set([
+        os.path.join(out_dir, 'audio'), os.path.join(out_dir, 'text')])
+    index_lines = []
     user_ids = set()
     recording_info = {}
+    token_id = None
     try:
-        for token in tqdm(dl_tokens):
-            copyfile(
-                token.get_path(),
-                os.path.join(out_dir, 'text/{}'.format(token.get_fname())))
-            for recording in token.recordings:
-                if recording.get_path() is not None:
-                    user_name = recording.get_user().name
-                    user_ids.add(recording.user_id)
-                    if not os.path.exists(
-                            os.path.join(out_dir, 'audio', user_name)):
-                        os.makedirs(os.path.join(out_dir, 'audio', user_name))
-                    copyfile(
-                        recording.get_path(),
-                        os.path.join(out_dir, 'audio/{}/{}'.format(
-                            user_name, recording.get_fname())))
-                    recording_info[recording.id] = {
-                        'collection_info': {
-                            'recording_fname': recording.get_fname(),
-                            'text_fname': token.get_fname(),
-                            'text': token.text,
-                            'user_name': user_name,
-                            'user_id': recording.user_id,
-                            'session_id': recording.session.id
-                        }, 'recording_info': {
-                            'sr': recording.sr,
-                            'num_channels': recording.num_channels,
-                            'bit_depth': recording.bit_depth,
-                            'duration': recording.duration,
-                        }, 'other': {
-                            'transcription': recording.transcription,
-                            'recording_marked_bad': recording.marked_as_bad,
-                            'text_marked_bad': token.marked_as_bad}}
-                    index_f.write('{}\t{}\n'.format(
-                        recording.get_fname(), token.get_fname()))
-                else:
-                    print(
-                        f"Error - token {token.id} does not have a recording")
-        index_f.close()
+        for token, recording, _, _ in collection_export_rows(
+                int(collection_id), with_details=False):
+            if token.id != token_id:
+                files.append((
+                    token.get_path(),
+                    os.path.join(out_dir, 'text', token.get_fname())))
+                token_id = token.id
+            if recording.get_path() is None:
+                print(f"Error - token {token.id} does not have a recording")
+                continue
+            if recording.user_id not in user_names:
+                user_names[recording.user_id] = recording.get_user().name
+            user_name = user_names[recording.user_id]
+            user_ids.add(recording.user_id)
+            directories.add(os.path.join(out_dir, 'audio', user_name))
+            files.append((
+                recording.get_path(),
+                os.path.join(
+                    out_dir, 'audio', user_name, recording.get_fname())))
+            recording_info[recording.id] = {
+                'collection_info': {
+                    'recording_fname': recording.get_fname(),
+                    'text_fname': token.get_fname(),
+                    'text': token.text,
+                    'user_name': user_name,
+                    'user_id': recording.user_id,
+                    'session_id': recording.session_id
+                }, 'recording_info': {
+                    'sr': recording.sr,
+                    'num_channels': recording.num_channels,
+                    'bit_depth': recording.bit_depth,
+                    'duration': recording.duration,
+                }, 'other': {
+                    'transcription': recording.transcription,
+                    'recording_marked_bad': recording.marked_as_bad,
+                    'text_marked_bad': token.marked_as_bad}}
+            index_lines.append('{}\t{}\n'.format(
+                recording.get_fname(), token.get_fname()))
+
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+
+        results = defaultdict(int)
+        with ThreadPoolExecutor(max_workers=int(num_workers)) as pool:
+            for result in tqdm(pool.map(
+                    lambda f: link_or_copy(*f, resume=resume), files),
+                    total=len(files)):
+                results[result] += 1
+        print(', '.join(f'{num} {result}' for result, num in results.items()))
+
+        with open(os.path.join(out_dir, 'index.tsv'), 'w') as index_f:
+            index_f.writelines(index_lines)
         with open(os.path.join(out_dir, 'info.json'), 'w', encoding='utf-8') \
                 as info_f:
             json.dump(recording_info, info_f, ensure_ascii=False, indent=4)
-
-        meta = {'speakers': []}
-        for id in user_ids:
-            meta['speakers'].append(User.query.get(id).get_meta())
-
-        meta['collection'] = collection.get_meta()
         with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') \
                 as meta_f:
-            json.dump(meta, meta_f, ensure_ascii=False, indent=4)
+            json.dump(collection_meta(collection, user_ids), meta_f,
+                      ensure_ascii=False, indent=4)
 
         print("Done!, data available at {}".format(out_dir))
 
@@ -304,6 +330,34 @@ def download_collection(collection_id, out_dir):
         print("{}\n{}".format(error, traceback.format_exc()))
 
 
+@manager.command
+def merlin_format(out_dir, collection_id=None, src_dir=None, manifest=None,
+                  from_index=False, num_workers=16):
+    '''
+    Creates a Merlin compatible dataset at out_dir, either straight from
+    the files of a collection (collection_id) or from an extracted
+    collection archive (src_dir), read with info.json, the columnar
+    tables of export_metadata (manifest) or index.tsv (--from_index)
+    '''
+    if collection_id is not None:
+        pairs = [
+            (recording.get_zip_path(), token.get_path())
+            for token, recording, _, _ in collection_export_rows(
+                int(collection_id), with_details=False)
+            if recording.get_zip_path() is not None]
+        done = write_merlinformat(
+            pairs, out_dir, num_workers=int(num_workers))
+    elif src_dir is not None:
+        done = ds_to_merlinformat(
+            src_dir, out_dir, use_json=manifest is None and not from_index,
+            manifest_path=manifest, num_workers=int(num_workers))
+    else:
+        print('Either collection_id or src_dir is required')
+        return
+    if done:
+        print("Done!, data available at {}".format(out_dir))
+
+
 @manager.command
 def update_session_verifications():
     '''
@@ -329,19 +383,71 @@ def release_unverified_sessions():
     This releases the user id from those sessions that have a user id
     but have not been fully verified.
 
-    Note: this likely never happens as the hogging user will be
-    queued with the first session with its user id.
+    Note: claims now expire on their own, see sweep_session_claims
+    for releasing only the expired ones.
     '''
-    releasable_sessions = Session.query.filter(
-        and_(not Session.is_verified == False,
-             Session.is_secondarily_verified == False))
+    for model in (Session, PrioritySession):
+        for is_secondary in (False, True):
+            done, claimed_by, claimed_at = session_claim_columns(
+                is_secondary, model)
+            num_released = model.query\
+                .filter(done == False, claimed_by != None)\
+                .update({claimed_by: None, claimed_at: None},
+                        synchronize_session=False)
+            print('Released {} {} {} claims'.format(
+                num_released, model.__tablename__,
+                'secondary' if is_secondary else 'primary'))
+    db.session.commit()
 
-    for session in releasable_sessions:
-        session.verified_by = None
-        session.secondarily_verified_by = None
+
+@manager.command
+def sweep_session_claims(release=False):
+    '''
+    Reports the verification claims that have expired, i.e. where the
+    verifier has not submitted anything for VERIFICATION_LEASE_SECONDS,
+    per verifier. Expired claims are taken over by the next verifier
+    anyway, so releasing them with --release only tidies up. Meant to
+    be run periodically, e.g. from cron.
+    '''
+    for model in (Session, PrioritySession):
+        for is_secondary in (False, True):
+            _, claimed_by, claimed_at = session_claim_columns(
+                is_secondary, model)
+            expired = expired_session_claims(is_secondary, model)
+            num_sessions = db.func.count(model.id)
+            per_user = expired.with_entities(claimed_by, num_sessions)\
+                .group_by(claimed_by)\
+                .order_by(num_sessions.desc())
+            kind = '{} {}'.format(
+                model.__tablename__,
+                'secondary' if is_secondary else 'primary')
+            for user_id, num_sessions in per_user:
+                user = User.query.get(user_id)
+                print('{}: {} expired {} claims'.format(
+                    user.get_printable_name() if user else user_id,
+                    num_sessions, kind))
+            if release:
+                num_released = expired.update(
+                    {claimed_by: None, claimed_at: None},
+                    synchronize_session=False)
+                print('Released {} expired {} claims'.format(
+                    num_released, kind))
     db.session.commit()
 
 
+@manager.command
+def rollup_activity(full=False):
+    '''
+    Updates the daily activity counts of verifications, recordings and
+    sessions that the activity charts are drawn from. Meant to be run
+    daily, e.g. from cron, shortly after midnight. Use --full to recount
+    every day, e.g. after rows have been deleted.
+    '''
+    for model in (Verification, Recording, Session):
+        refresh_activity_rollup(model, full=full)
+        print('Rolled up {}'.format(model.__tablename__))
+
+
 @manager.command
 def update_numbers():
     '''
@@ -352,6 +458,10 @@ def update_numbers():
         * num_invalid_tokens
     And the following of the Token class:
         * num_recordings
+    And the following of the Session class:
+        * num_recordings
+        * num_verified
+        * num_secondarily_verified
     '''
     recordings = Recording.query.all()
     token_recordings = defaultdict(int)
@@ -374,6 +484,11 @@ def update_numbers():
         collection.update_numbers()
     db.session.commit()
 
+    for session in tqdm(
+            Session.query.options(noload(Session.recordings)).all()):
+        session.update_numbers()
+    db.session.commit()
+
 
 @manager.command
 def set_dev_sessions():
@@ -411,22 +526,363 @@ def set_not_dev_collections():
 
 
 @manager.command
-def update_analysis():
+def update_analysis(collection_id=None, start_date=None, end_date=None,
+                    num_workers=None, batch_size=500, retry_failed=False):
     '''
-    Performs analysis on all recordings that don't have analysis
+    Computes the quality metrics of all recordings that don't have them
+    using a pool of worker processes. Recordings without a volume
+    analysis also get one, computed with the thresholds of their
+    collection configuration. Existing analysis is left alone.
+    Recordings are read and submitted batch_size at a time, with at
+    most two per worker in flight, so memory stays flat however large
+    the collection is. Results are committed per batch so an
+    interrupted run can simply be started again. Recordings that can't
+    be analyzed are marked with qc_failed and skipped by later runs
+    unless --retry_failed is given.
+    Input arguments:
+    * collection_id: only analyze recordings in this collection
+    * start_date, end_date (YYYY-MM-DD): only analyze recordings
+    created in this range, end date inclusive
+    * num_workers: number of processes, defaults to the number of CPUs
+    * batch_size: number of recordings per query and commit
+    * retry_failed: also analyze recordings that failed before
     '''
-    recordings = Recording.query.filter(Recording.analysis == None)
-    for r in tqdm(recordings):
-        # load the sample
-        sample, _ = load_sample(r.path)
-        # check the sample and return the response
-        if signal_is_too_high(sample):
-            r.analysis = 'high'
-        elif signal_is_too_low(sample):
-            r.analysis = 'low'
-        else:
-            r.analysis = 'ok'
+    batch_size = int(batch_size)
+    num_workers = int(num_workers) if num_workers else os.cpu_count()
+    recordings = db.session.query(
+        Recording.id, Recording.wav_path, Recording.path,
+        Recording.analysis, Configuration.too_high_threshold,
+        Configuration.too_high_frames, Configuration.too_low_threshold)\
+        .join(Token, Recording.token_id == Token.id)\
+        .join(Collection, Token.collection_id == Collection.id)\
+        .outerjoin(
+            Configuration, Collection.configuration_id == Configuration.id)\
+        .filter(Recording.peak_db == None)
+    if not retry_failed:
+        recordings = recordings.filter(Recording.qc_failed.isnot(True))
+    if collection_id is not None:
+        recordings = recordings.filter(
+            Token.collection_id == int(collection_id))
+    if start_date is not None:
+        recordings = recordings.filter(
+            Recording.created_at >= datetime.datetime.strptime(
+                start_date, '%Y-%m-%d'))
+    if end_date is not None:
+        recordings = recordings.filter(
+            Recording.created_at < datetime.datetime.strptime(
+                end_date, '%Y-%m-%d') + datetime.timedelta(days=1))
+    num_jobs = recordings.count()
+    print(f'Analyzing {num_jobs} recordings')
+
+    def jobs():
+        # paged by id, so the commits in between don't affect the paging
+        last_id = 0
+        while True:
+            rows = recordings.filter(Recording.id > last_id)\
+                .order_by(Recording.id).limit(batch_size).all()
+            if not rows:
+                return
+            for id, wav_path, path, analysis, high_thresh, high_frames, \
+                    low_thresh in rows:
+                volume_thresholds = None
+                if analysis is None:
+                    volume_thresholds = {
+                        name: value for name, value in (
+                            ('high_thresh', high_thresh),
+                            ('high_frames', high_frames),
+                            ('low_thresh', low_thresh))
+                        if value is not None}
+                # the WAV files were already converted on upload, only
+                # fall back to decoding the webm if they are missing
+                yield (id, wav_path if wav_path is not None else path,
+                       volume_thresholds)
+            last_id = rows[-1].id
+
+    def results(pool):
+        in_flight = deque()
+        for id, path, volume_thresholds in jobs():
+            in_flight.append((id, path, pool.submit(
+                analyze_file, path, volume_thresholds)))
+            # keep a bounded number of recordings in flight
+            if len(in_flight) >= 2 * num_workers:
+                yield in_flight.popleft()
+        yield from in_flight
+
+    num_done, num_failed, batch = 0, 0, []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for id, path, future in tqdm(results(pool), total=num_jobs):
+            try:
+                batch.append(
+                    {'id': id, 'qc_failed': False, **future.result()})
+            except Exception as error:
+                num_failed += 1
+                batch.append({'id': id, 'qc_failed': True})
+                print(f'Recording {id} ({path}): {error}')
+            if len(batch) >= batch_size:
+                db.session.bulk_update_mappings(Recording, batch)
+                db.session.commit()
+                num_done += len(batch)
+                batch = []
+    if batch:
+        db.session.bulk_update_mappings(Recording, batch)
+        db.session.commit()
+        num_done += len(batch)
+
+    elapsed = time.time() - start
+    print(f'Analyzed {num_done - num_failed} recordings ({num_failed} '
+          f'failed) in {elapsed:.1f}s, '
+          f'{num_done / max(elapsed, 1e-6):.1f} rec/s')
+
+
+@manager.command
+def export_shards(collection_id, shard_size=1000, max_shard_mb=1024,
+                  num_workers=8):
+    '''
+    Exports a collection as WebDataset tar shards to SHARD_DIR
+    Input arguments:
+    * shard_size (-s): Maximum number of samples per shard
+    * max_shard_mb (-m): Maximum size of audio per shard in MB
+    * num_workers (-n): Number of shards written at the same time
+    '''
+    start = time.time()
+    shard_dir = create_collection_shards(
+        int(collection_id), shard_size=int(shard_size),
+        shard_max_mb=int(max_shard_mb), num_workers=int(num_workers))
+    print(f'Shards written to {shard_dir} in {time.time() - start:.1f}s')
+
+
+@manager.command
+def export_metadata(collection_id):
+    '''
+    Exports the metadata of a collection as Parquet (or .npz) tables
+    to METADATA_EXPORT_DIR
+    '''
+    print(f'Tables written to {create_collection_metadata(int(collection_id))}')
+
+
+@manager.command
+def update_waveform_peaks(collection_id=None):
+    '''
+    Creates waveform peak files for all recordings that don't have
+    them, optionally only for a single collection
+    '''
+    recordings = Recording.query
+    if collection_id is not None:
+        recordings = recordings.join(Recording.token).filter(
+            Token.collection_id == int(collection_id))
+    for r in tqdm(recordings, total=recordings.count()):
+        if os.path.exists(r.get_peaks_path()):
+            continue
+        try:
+            create_recording_peaks(r)
+        except Exception as error:
+            print(f'Recording {r.id}: {error}')
+
+
+@manager.command
+def update_recording_previews(collection_id=None):
+    '''
+    Creates the low bitrate previews verifiers listen to for all
+    recordings that don't have them, optionally only for a single
+    collection
+    '''
+    recordings = Recording.query
+    if collection_id is not None:
+        recordings = recordings.join(Recording.token).filter(
+            Token.collection_id == int(collection_id))
+    for r in tqdm(recordings, total=recordings.count()):
+        if os.path.exists(r.get_preview_path()):
+            continue
+        try:
+            create_recording_preview(r)
+        except Exception as error:
+            print(f'Recording {r.id}: {error}')
+
+
+@manager.command
+def benchmark_analysis(path, num_requests=200, concurrency=8):
+    '''
+    Measures the latency of the live analysis done on each utterance
+    under concurrent load. path should point to a blob as posted by the
+    recorder. Reports p50/p99 for decoding through a temporary file
+    (the old behaviour) and for decoding straight from memory.
+    Input arguments:
+    * path: The blob to analyze
+    * num_requests (-n): Number of requests per variant
+    * concurrency (-c): Number of requests running at the same time
+    '''
+    num_requests, concurrency = int(num_requests), int(concurrency)
+    with open(path, 'rb') as blob_f:
+        data = blob_f.read()
+    if not os.path.exists(app.config['TEMP_DIR']):
+        os.makedirs(app.config['TEMP_DIR'])
+
+    def from_disk(i):
+        start = time.perf_counter()
+        file_path = os.path.join(
+            app.config['TEMP_DIR'], f'benchmark_{i}_{os.path.basename(path)}')
+        with open(file_path, 'wb') as temp_f:
+            temp_f.write(data)
+        analyze_sample(*load_sample(file_path))
+        os.remove(file_path)
+        return time.perf_counter() - start
+
+    def from_memory(i):
+        start = time.perf_counter()
+        analyze_sample(*load_sample_from_bytes(data))
+        return time.perf_counter() - start
+
+    for name, func in [('temp file', from_disk), ('in memory', from_memory)]:
+        # the first call pays for imports and JIT compilation
+        func('warmup')
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = np.array(list(
+                executor.map(func, range(num_requests)))) * 1000
+        print(f'{name}: p50 {np.percentile(latencies, 50):.1f} ms, '
+              f'p99 {np.percentile(latencies, 99):.1f} ms '
+              f'({num_requests} requests, {concurrency} concurrent)')
+
+
+@manager.command
+def benchmark_verification(num_recordings=50, batch_size=10, sessions=5,
+                           database_url=None):
+    '''
+    Measures the verify_session flow through the test client. For each
+    session it reports the number of HTTP requests, SQL statements and
+    commits and the total time, and p50/p99 per request type. It does
+    this once with every recording posted on its own to
+    create_verification and once with batches posted to
+    create_verifications, where the next session comes from
+    next_session instead of a page load.
+    Runs against a throwaway SQLite database in TEMP_DIR unless
+    database_url is given. Every table in that database is dropped.
+    Input arguments:
+    * num_recordings (-n): Recordings per session
+    * batch_size (-b): Verifications per create_verifications request
+    * sessions (-s): Sessions verified in each flow
+    * database_url (-d): A scratch database to run against
+    '''
+    num_recordings, batch_size = int(num_recordings), int(batch_size)
+    sessions = int(sessions)
+    if database_url is None:
+        os.makedirs(app.config['TEMP_DIR'], exist_ok=True)
+        database_url = 'sqlite:///{}'.format(os.path.join(
+            app.config['TEMP_DIR'], 'benchmark_verification.db'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.drop_all()
+    db.create_all()
+
+    collection = Collection()
+    collection.verify = True
+    progression = VerifierProgression()
+    db.session.add_all([collection, progression])
+    db.session.flush()
+    verifier = User(email='benchmark@lobe.is', active=True)
+    verifier.progression_id = progression.id
+    db.session.add(verifier)
+    db.session.flush()
+    session_ids = []
+    for _ in range(2 * sessions):
+        session = Session(verifier.id, collection.id, verifier.id)
+        db.session.add(session)
+        db.session.flush()
+        tokens = [
+            Token(f'Setning {i}', 'benchmark.token', collection.id)
+            for i in range(num_recordings)]
+        db.session.add_all(tokens)
+        db.session.flush()
+        for token in tokens:
+            recording = Recording(
+                token.id, 'benchmark.webm', verifier.id,
+                session_id=session.id)
+            recording.fname = f'benchmark_{token.id:09d}.webm'
+            db.session.add(recording)
+        db.session.flush()
+        session.update_numbers()
+        session_ids.append(session.id)
+    verifier_id = verifier.id
     db.session.commit()
+    db.session.remove()
+
+    counts = {'statements': 0, 'commits': 0}
+
+    def count_statement(*args):
+        counts['statements'] += 1
+
+    def count_commit(*args):
+        counts['commits'] += 1
+
+    engine = db.get_engine()
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    event.listen(engine, 'commit', count_commit)
+
+    client = app.test_client()
+    with client.session_transaction() as client_session:
+        client_session['user_id'] = str(verifier_id)
+        client_session['_user_id'] = str(verifier_id)
+        client_session['_fresh'] = True
+
+    latencies = defaultdict(list)
+
+    def timed(name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = method(url, **kwargs)
+        latencies[name].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise ValueError(f'{name} returned {response.status_code}: '
+                             f'{response.get_data(as_text=True)[:200]}')
+        return response
+
+    def verification(recording_id):
+        return {'recording': recording_id, 'num_verifies': 0,
+                'quality': ['ok'], 'comment': '', 'cut': []}
+
+    def one_by_one(session_id, recording_ids):
+        timed('verify_session', client.get, url_for(
+            'verification.verify_session', id=session_id))
+        for recording_id in recording_ids:
+            timed('create_verification', client.post, url_for(
+                'verification.create_verification'), data={
+                    'recording': recording_id, 'verified_by': verifier_id,
+                    'session': session_id, 'num_verifies': 0, 'cut': '[]',
+                    'isPriority': 'False', 'comment': '', 'quality': 'ok'})
+
+    def batched(session_id, recording_ids):
+        timed('next_session', client.get, url_for(
+            'verification.next_session', current=session_id))
+        for i in range(0, len(recording_ids), batch_size):
+            timed('create_verifications', client.post, url_for(
+                'verification.create_verifications'), json={
+                    'session': session_id, 'isPriority': 'False',
+                    'verified_by': verifier_id,
+                    'verifications': [
+                        verification(recording_id) for recording_id
+                        in recording_ids[i:i + batch_size]]})
+
+    for name, flow, flow_session_ids in [
+            ('one by one', one_by_one, session_ids[:sessions]),
+            ('batched', batched, session_ids[sessions:])]:
+        latencies.clear()
+        counts.update(statements=0, commits=0)
+        start = time.perf_counter()
+        for session_id in flow_session_ids:
+            recording_ids = [id for id, in db.session.query(Recording.id)
+                             .filter(Recording.session_id == session_id)
+                             .order_by(Recording.id)]
+            db.session.remove()
+            flow(session_id, recording_ids)
+        elapsed = time.perf_counter() - start
+        num_requests = sum(len(times) for times in latencies.values())
+        print(f'{name}: per session {num_requests / sessions:.1f} '
+              f'requests, {counts["statements"] / sessions:.1f} '
+              f'statements, {counts["commits"] / sessions:.1f} commits, '
+              f'{1000 * elapsed / sessions:.1f} ms')
+        for request_name, times in latencies.items():
+            times = np.array(times) * 1000
+            print(f'  {request_name}: p50 {np.percentile(times, 50):.1f} '
+                  f'ms, p99 {np.percentile(times, 99):.1f} ms '
+                  f'({len(times)} requests)')
 
 
 @manager.command
@@ -624,14 +1080,21 @@ def delta_balance():
 
 @manager.command
 def reset_weekly_challenge():
-    verifiers = get_verifiers()
-    best_verifier = sorted(
-        verifiers,
-        key=lambda v: -v.progression.weekly_verifies)[0]
+    # (user id, progression) of every verifier, best one first
+    verifiers = db.session.query(User.id, VerifierProgression)\
+        .join(VerifierProgression,
+              User.progression_id == VerifierProgression.id)\
+        .filter(verifiers_filter())\
+        .order_by(VerifierProgression.weekly_verifies.desc().nullslast(),
+                  User.id)\
+        .all()
+    if not verifiers:
+        return
+    best_verifier_id = verifiers[0][0]
 
     # check for price and award
     coin_price, experience_price = 0, 0
-    weekly_verifies = sum([v.progression.weekly_verifies for v in verifiers])
+    weekly_verifies = sum([p.weekly_verifies or 0 for _, p in verifiers])
     weekly_params = app.config['ECONOMY']['weekly_challenge']
     weekly_goal = weekly_params['goal']
     if weekly_verifies > weekly_goal:
@@ -643,13 +1106,12 @@ def reset_weekly_challenge():
         experience_price += extra * weekly_params['extra_experience_reward']
 
     # give prices and reset counters
-    for verifier in verifiers:
+    for user_id, progression in verifiers:
         v_coin_price, v_experience_price = coin_price, experience_price
-        if verifier.id == best_verifier.id:
+        if user_id == best_verifier_id:
             v_coin_price += weekly_params['best_coin_reward']
             v_experience_price += weekly_params['best_experience_reward']
 
-        progression = verifier.progression
         progression.weekly_verifies = 0
         progression.lobe_coins += v_coin_price
         progression.experience += v_experience_price
@@ -697,19 +1159,70 @@ def respin():
 
 
 
+def _wav_duration(path):
+    with wave.open(path, 'rb') as f:
+        return f.getnframes() / float(f.getframerate())
+
+
 @manager.command
-def accurate_time():
-    collections = Collection.query.all()
-    print('Select a collection id')
-    for collection in collections:
-        print(f'{collection.name} [{collection.id}]')
-    collection = Collection.query.get(int(input('Selection: ')))
-    out = os.popen(
-        f'soxi -D {collection.get_wav_audio_dir()}/* | paste -sd+ | bc').read()
-
-    out = float(out.strip('\n')) - collection.num_recorded_tokens*2
-    hours = out/3600
-    print(f'The collection has {hours:.3f} recorded hours')
+def update_durations(collection_id=None, num_workers=16, batch_size=1000):
+    '''
+    Fills in Recording.duration from the WAV headers of all recordings
+    that are missing it. Headers are read by a thread pool and results
+    committed in batches so the command can be interrupted and rerun.
+    '''
+    batch_size = int(batch_size)
+    recordings = db.session.query(Recording.id, Recording.wav_path)\
+        .filter(Recording.duration == None, Recording.wav_path != None)
+    if collection_id is not None:
+        recordings = recordings.join(Recording.token).filter(
+            Token.collection_id == int(collection_id))
+    jobs = recordings.order_by(Recording.id).all()
+
+    def read_duration(job):
+        id, wav_path = job
+        try:
+            return {'id': id, 'duration': _wav_duration(wav_path)}
+        except Exception as error:
+            print(f'Recording {id} ({wav_path}): {error}')
+            return None
+
+    batch = []
+    with ThreadPoolExecutor(max_workers=int(num_workers)) as pool:
+        for result in tqdm(pool.map(read_duration, jobs), total=len(jobs)):
+            if result is not None:
+                batch.append(result)
+            if len(batch) >= batch_size:
+                db.session.bulk_update_mappings(Recording, batch)
+                db.session.commit()
+                batch = []
+    if batch:
+        db.session.bulk_update_mappings(Recording, batch)
+        db.session.commit()
+
+
+@manager.command
+def accurate_time(collection_id=None):
+    '''
+    Prints the recorded hours of a collection, in total, after trimming
+    and per speaker, based on Recording.duration
+    '''
+    if collection_id is None:
+        print('Select a collection id')
+        for collection in Collection.query.all():
+            print(f'{collection.name} [{collection.id}]')
+        collection_id = input('Selection: ')
+    collection = Collection.query.get(int(collection_id))
+    recorded_time = collection.get_recorded_time()
+
+    print(f'The collection has {recorded_time["total"]/3600:.3f} recorded '
+          f'hours, {recorded_time["trimmed"]/3600:.3f} after trimming')
+    for user_id, speaker_time in recorded_time['speakers'].items():
+        print(f'  Speaker {user_id}: {speaker_time["total"]/3600:.3f} / '
+              f'{speaker_time["trimmed"]/3600:.3f} hours')
+    if recorded_time['num_missing'] > 0:
+        print(f'{recorded_time["num_missing"]} recordings have no duration, '
+              'run update_durations first')
 
 
 @manager.command
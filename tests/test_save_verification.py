@@ -0,0 +1,94 @@
+'''
+Tests for the session bookkeeping of lobe.db.save_verification
+'''
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from lobe.db import save_verification
+from lobe.models import (Collection, PrioritySession, Recording, Session,
+                         User, VerifierProgression, db)
+from lobe.settings.common import ECONOMY
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+        tmp_path / 'lobe.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['VERIFICATION_LEASE_SECONDS'] = 60 * 60
+    app.config['ECONOMY'] = ECONOMY
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def verify(recording, session, verifier, is_priority=False):
+    form = SimpleNamespace(data={
+        'isPriority': str(is_priority),
+        'num_verifies': '0',
+        'quality': [],
+        'comment': '',
+        'recording': str(recording.id),
+        'verified_by': str(verifier.id),
+        'session': str(session.id),
+        'cut': '[]'})
+    progression = VerifierProgression()
+    db.session.add(progression)
+    db.session.flush()
+    save_verification(form, progression)
+    db.session.commit()
+    return progression
+
+
+def test_priority_then_normal_verification_completes_session(app):
+    collection = Collection()
+    verifier = User(email='verifier@lobe.is', active=True)
+    db.session.add_all([collection, verifier])
+    db.session.flush()
+    session = Session(None, collection.id, None)
+    session.num_recordings = 2
+    priority_session = PrioritySession(None, collection.id, None)
+    db.session.add_all([session, priority_session])
+    db.session.flush()
+    first, second = [
+        Recording(None, 'recording.webm', None, session_id=session.id)
+        for _ in range(2)]
+    first.priority_session_id = priority_session.id
+    db.session.add_all([first, second])
+    db.session.commit()
+
+    verify(first, priority_session, verifier, is_priority=True)
+    assert session.num_verified == 1
+    assert not session.is_verified
+    assert priority_session.is_verified
+
+    progression = verify(second, session, verifier)
+    assert first.is_verified and second.is_verified
+    assert session.num_verified == 2
+    assert session.is_verified
+    assert progression.num_session_verifies == 1
+
+
+def test_verifying_twice_counts_once(app):
+    collection = Collection()
+    verifier = User(email='verifier@lobe.is', active=True)
+    db.session.add_all([collection, verifier])
+    db.session.flush()
+    session = Session(None, collection.id, None)
+    session.num_recordings = 2
+    db.session.add(session)
+    db.session.flush()
+    recording = Recording(None, 'recording.webm', None, session_id=session.id)
+    db.session.add(recording)
+    db.session.commit()
+
+    verify(recording, session, verifier)
+    verify(recording, session, verifier)
+    assert session.num_verified == 1
+    assert not session.is_verified